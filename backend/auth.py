@@ -1,37 +1,60 @@
 # auth.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from passlib.hash import bcrypt
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from collections import namedtuple
+import os
 from models import User
-from schemas import RegisterModel
+from schemas import RegisterModel, RefreshTokenModel
 from database import get_db
+from passwords import hash_password, verify_password
+from tokens import (
+    ACCESS_TOKEN_TTL,
+    TokenError,
+    create_access_token,
+    create_refresh_token,
+    decode_token,
+)
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+oauth2_optional = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
+# Immutable snapshot of the authenticated user, rebuilt from token claims
+Principal = namedtuple("Principal", "id username first_name last_name")
+
+# Comma-separated usernames allowed to use the admin-only routes and headers
+ADMIN_USERNAMES = {u.strip() for u in os.getenv("ADMIN_USERNAMES", "").split(",") if u.strip()}
+
+def _find_user(db: Session, username):
+    return db.query(User).filter_by(username=username).first()
+
+def _add_user(db: Session, user):
+    db.add(user)
+    db.commit()
+
+# Password hashing runs on the dedicated pool in passwords.py; only the short
+# database calls borrow FastAPI's threadpool, so a login storm can't starve it.
 @router.post("/register")
-def register(data: RegisterModel, db: Session = Depends(get_db)):
-    if db.query(User).filter_by(username=data.username).first():
+async def register(data: RegisterModel, db: Session = Depends(get_db)):
+    if await run_in_threadpool(_find_user, db, data.username):
         raise HTTPException(400, "User already exists")
     user = User(
         username=data.username,
-        password_hash=bcrypt.hash(data.password),
+        password_hash=await hash_password(data.password),
         first_name=data.first_name,
         last_name=data.last_name
     )
-    db.add(user)
-    db.commit()
+    await run_in_threadpool(_add_user, db, user)
     return {"msg": "User registered"}
 
-@router.post("/login")
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter_by(username=form.username).first()
-    if not user or not bcrypt.verify(form.password, user.password_hash):
-        raise HTTPException(401, "Invalid credentials")
+def _token_response(user):
     return {
-        "access_token": user.username,
+        "access_token": create_access_token(user),
+        "refresh_token": create_refresh_token(user),
         "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL,
         "user": {
             "username": user.username,
             "first_name": user.first_name,
@@ -39,8 +62,68 @@ def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get
         }
     }
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    user = db.query(User).filter_by(username=token).first()
+@router.post("/login")
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_user, db, form.username)
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid user")
+        raise HTTPException(401, "Invalid credentials")
+    valid, new_hash = await verify_password(form.password, user.password_hash)
+    if not valid:
+        raise HTTPException(401, "Invalid credentials")
+    response = _token_response(user)
+    if new_hash:
+        # Stored hash used outdated parameters, upgrade it transparently
+        user.password_hash = new_hash
+        await run_in_threadpool(db.commit)
+    return response
+
+@router.post("/refresh")
+def refresh(data: RefreshTokenModel, db: Session = Depends(get_db)):
+    try:
+        claims = decode_token(data.refresh_token, "refresh")
+    except TokenError as e:
+        raise HTTPException(401, str(e))
+    # Re-read the user so renamed or deleted accounts are picked up
+    user = db.query(User).filter_by(id=int(claims["sub"])).first()
+    if not user:
+        raise HTTPException(401, "Invalid user")
+    return _token_response(user)
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    # Verified purely from the signed token, no database lookup
+    try:
+        claims = decode_token(token, "access")
+    except TokenError as e:
+        raise HTTPException(401, str(e), headers={"WWW-Authenticate": "Bearer"})
+    return _principal(claims)
+
+def _principal(claims):
+    return Principal(
+        int(claims["sub"]),
+        claims.get("username"),
+        claims.get("first_name"),
+        claims.get("last_name"),
+    )
+
+def get_stream_user(request: Request, token: str = Depends(oauth2_optional), ticket: str = Query(None)):
+    # EventSource cannot send headers, so streams also take ?ticket= from
+    # the stream's ticket endpoint: short-lived and valid for this path only
+    if token:
+        return get_current_user(token)
+    if not ticket:
+        raise HTTPException(401, "Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        claims = decode_token(ticket, "stream")
+    except TokenError as e:
+        raise HTTPException(401, str(e), headers={"WWW-Authenticate": "Bearer"})
+    if claims.get("path") != request.url.path:
+        raise HTTPException(401, "Ticket is not valid for this stream.", headers={"WWW-Authenticate": "Bearer"})
+    return _principal(claims)
+
+def is_admin_username(username):
+    return username is not None and username in ADMIN_USERNAMES
+
+def require_admin(user = Depends(get_current_user)):
+    if not is_admin_username(user.username):
+        raise HTTPException(403, "Admin access required.")
     return user
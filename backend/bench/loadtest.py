@@ -0,0 +1,247 @@
+# bench/loadtest.py
+# Drives the backend at a fixed concurrency and reports throughput and
+# p50/p95/p99 latency per route. Point the backend at bench/powerbi_stub.py
+# (and DATABASE_URL at a scratch database) for reproducible runs:
+#
+#   python bench/loadtest.py --base-url http://localhost:8000 \
+#       --concurrency 32 --duration 60 --scenarios login,reports,create-embed,layouts
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+import httpx
+
+SCENARIOS = ("login", "reports", "create-embed", "layouts")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    async def call(self, name, client, method, url, ok=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.latencies[name].append(time.perf_counter() - start)
+            self.errors[name] += 1
+            self.statuses[name][type(e).__name__] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - start)
+        self.statuses[name][resp.status_code] += 1
+        if resp.status_code not in ok:
+            self.errors[name] += 1
+            return None
+        return resp
+
+    def summary(self, elapsed):
+        rows = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            rows[name] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": _percentile(values, 50),
+                "p95_ms": _percentile(values, 95),
+                "p99_ms": _percentile(values, 99),
+                "max_ms": round(values[-1] * 1000, 2),
+                "statuses": {str(k): v for k, v in self.statuses[name].items()},
+            }
+        return rows
+
+
+def _percentile(sorted_values, pct):
+    # Nearest-rank percentile, in milliseconds
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[rank] * 1000, 2)
+
+
+class Session:
+    """One benchmark user with its token and a report to embed."""
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.headers = {}
+        self.report = None
+
+    async def setup(self, client, args):
+        await client.post("/register", json={
+            "username": self.username,
+            "password": self.password,
+            "first_name": "Bench",
+            "last_name": "User",
+        })  # 400 when the user exists from an earlier run
+        await self.login(client)
+        resp = await client.post("/credentials", headers=self.headers, json={
+            "client_id": args.client_id,
+            "tenant_id": args.tenant_id,
+            "secret": args.client_secret,
+        })
+        resp.raise_for_status()
+        if {"reports", "create-embed"} & set(args.scenarios):
+            resp = await client.get("/reports", headers=self.headers)
+            resp.raise_for_status()
+            reports = resp.json()
+            if not reports:
+                raise SystemExit("GET /reports returned no reports to embed.")
+            self.report = reports[0]
+
+    async def login(self, client, recorder=None):
+        form = {"username": self.username, "password": self.password}
+        if recorder is None:
+            resp = await client.post("/login", data=form)
+            resp.raise_for_status()
+        else:
+            resp = await recorder.call("POST /login", client, "POST", "/login", data=form)
+            if resp is None:
+                return
+        self.headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+
+async def run_login(session, client, recorder, args):
+    await session.login(client, recorder)
+
+async def run_reports(session, client, recorder, args):
+    params = {"refresh": "true"} if args.reports_refresh else None
+    await recorder.call("GET /reports", client, "GET", "/reports", headers=session.headers, params=params)
+
+async def run_create_embed(session, client, recorder, args):
+    report = session.report
+    await recorder.call("POST /create-embed", client, "POST", "/create-embed", headers=session.headers, json={
+        "group_id": report["workspace_id"],
+        "report_id": report["report_id"],
+        "dataset_id": report.get("dataset_id") or "",
+    })
+
+async def run_layouts(session, client, recorder, args):
+    # One full create/list/read/update/patch/delete cycle
+    items = [
+        {"report_id": str(uuid.uuid4()), "group_id": str(uuid.uuid4()), "report_name": f"Report {i}"}
+        for i in range(args.layout_items)
+    ]
+    resp = await recorder.call("POST /dashboard-layout", client, "POST", "/dashboard-layout", headers=session.headers, json={
+        "layout_name": f"bench-{uuid.uuid4().hex}",
+        "description": "load test",
+        "layout_data": items,
+    })
+    if resp is None:
+        return
+    layout_id = resp.json()["id"]
+    path = f"/dashboard-layout/{layout_id}"
+    await recorder.call("GET /dashboard-layouts", client, "GET", "/dashboard-layouts", headers=session.headers, params={"limit": 50})
+    await recorder.call("GET /dashboard-layout/{id}", client, "GET", path, headers=session.headers)
+    resp = await recorder.call("PUT /dashboard-layout/{id}", client, "PUT", path, headers=session.headers, json={
+        "layout_name": f"bench-{uuid.uuid4().hex}",
+        "description": "load test, updated",
+        "layout_data": list(reversed(items)),
+    })
+    if resp is not None:
+        await recorder.call(
+            "PATCH /dashboard-layout/{id}", client, "PATCH", path,
+            headers={**session.headers, "If-Match": resp.headers.get("ETag", "*")},
+            json=[{"op": "replace", "path": "/description", "value": "patched"}],
+        )
+    await recorder.call("DELETE /dashboard-layout/{id}", client, "DELETE", path, headers=session.headers)
+
+RUNNERS = {
+    "login": run_login,
+    "reports": run_reports,
+    "create-embed": run_create_embed,
+    "layouts": run_layouts,
+}
+
+
+async def worker(session, client, recorder, args, deadline):
+    while time.perf_counter() < deadline:
+        scenario = random.choice(args.scenarios)
+        await RUNNERS[scenario](session, client, recorder, args)
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        sessions = [
+            Session(f"{args.user_prefix}{i}", args.password)
+            for i in range(min(args.users, args.concurrency))
+        ]
+        for session in sessions:
+            await session.setup(client, args)
+
+        if args.warmup:
+            warmup = Recorder()
+            deadline = time.perf_counter() + args.warmup
+            await asyncio.gather(*(
+                worker(sessions[i % len(sessions)], client, warmup, args, deadline)
+                for i in range(args.concurrency)
+            ))
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            worker(sessions[i % len(sessions)], client, recorder, args, deadline)
+            for i in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    results = {
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "scenarios": args.scenarios,
+        "routes": recorder.summary(elapsed),
+    }
+    _print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+def _print_table(results):
+    print(f"{results['concurrency']} workers, {results['duration_s']}s, scenarios: {', '.join(results['scenarios'])}")
+    header = f"{'route':<32}{'reqs':>8}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    total = 0
+    for name, row in results["routes"].items():
+        total += row["requests"]
+        print(
+            f"{name:<32}{row['requests']:>8}{row['errors']:>8}{row['rps']:>9}"
+            f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}"
+        )
+    print(f"total {total} requests, {round(total / results['duration_s'], 2)} req/s")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the dashboard backend.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before the run")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated mix of {', '.join(SCENARIOS)}")
+    parser.add_argument("--users", type=int, default=4, help="distinct users shared by the workers")
+    parser.add_argument("--user-prefix", default="bench-user-")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--client-id", default="bench-client")
+    parser.add_argument("--tenant-id", default="bench-tenant")
+    parser.add_argument("--client-secret", default="bench-secret")
+    parser.add_argument("--layout-items", type=int, default=12, help="reports per layout in the layouts scenario")
+    parser.add_argument("--reports-refresh", action="store_true", help="bypass the report catalog cache")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
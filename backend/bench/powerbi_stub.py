@@ -0,0 +1,155 @@
+# bench/powerbi_stub.py
+# Local stand-in for the AAD token endpoint and the Power BI REST routes the
+# backend calls, with injectable latency, errors and throttling.
+#
+#   uvicorn bench.powerbi_stub:app --port 8001          (from backend/)
+#   POWERBI_API_BASE=http://localhost:8001/v1.0/myorg \
+#   POWERBI_AUTHORITY_HOST=http://localhost:8001 uvicorn main:app
+#
+# Faults can also be changed at runtime with PUT /_stub/config.
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+config = {
+    # Mean added latency and its uniform +/- jitter, in milliseconds
+    "latency_ms": float(os.getenv("STUB_LATENCY_MS", "50")),
+    "jitter_ms": float(os.getenv("STUB_JITTER_MS", "20")),
+    # Fraction of requests answered with error_status / 429
+    "error_rate": float(os.getenv("STUB_ERROR_RATE", "0")),
+    "error_status": int(os.getenv("STUB_ERROR_STATUS", "500")),
+    "throttle_rate": float(os.getenv("STUB_THROTTLE_RATE", "0")),
+    "retry_after": int(os.getenv("STUB_RETRY_AFTER", "1")),
+    "workspaces": int(os.getenv("STUB_WORKSPACES", "20")),
+    "reports_per_workspace": int(os.getenv("STUB_REPORTS_PER_WORKSPACE", "25")),
+    "token_ttl": int(os.getenv("STUB_TOKEN_TTL", "3600")),
+    # 0 answers admin/groups with 401, like a credential without admin API access
+    "admin_api": int(os.getenv("STUB_ADMIN_API", "1")),
+}
+counters = {"requests": 0, "errors": 0, "throttled": 0}
+
+_NAMESPACE = uuid.UUID("6f1f1c2e-8d55-4f0e-9a53-7a0e2b1f0c11")
+
+def _id(*parts):
+    return str(uuid.uuid5(_NAMESPACE, "/".join(str(p) for p in parts)))
+
+def _workspace(i):
+    return {"id": _id("ws", i), "name": f"Workspace {i:03d}", "isReadOnly": False, "type": "Workspace"}
+
+def _report(ws_index, i):
+    ws_id = _id("ws", ws_index)
+    report_id = _id("report", ws_index, i)
+    return {
+        "id": report_id,
+        "name": f"Report {ws_index:03d}-{i:03d}",
+        "datasetId": _id("dataset", ws_index, i // 5),
+        "embedUrl": f"https://app.powerbi.com/reportEmbed?reportId={report_id}&groupId={ws_id}",
+        "webUrl": f"https://app.powerbi.com/groups/{ws_id}/reports/{report_id}",
+        "reportType": "PowerBIReport",
+    }
+
+def _workspace_index(group_id):
+    for i in range(config["workspaces"]):
+        if _id("ws", i) == group_id:
+            return i
+    raise HTTPException(404, {"error": {"code": "PowerBIEntityNotFound"}})
+
+
+app = FastAPI(title="Power BI stub")
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    if request.url.path.startswith("/_stub"):
+        return await call_next(request)
+    counters["requests"] += 1
+    delay = config["latency_ms"] + random.uniform(-config["jitter_ms"], config["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    roll = random.random()
+    if roll < config["throttle_rate"]:
+        counters["throttled"] += 1
+        return JSONResponse(
+            {"error": {"code": "TooManyRequests"}},
+            status_code=429,
+            headers={"Retry-After": str(config["retry_after"])},
+        )
+    if roll < config["throttle_rate"] + config["error_rate"]:
+        counters["errors"] += 1
+        return JSONResponse({"error": {"code": "InjectedFailure"}}, status_code=config["error_status"])
+    return await call_next(request)
+
+@app.get("/_stub/config")
+def get_config():
+    return {"config": config, "counters": counters}
+
+@app.put("/_stub/config")
+def update_config(changes: dict):
+    unknown = set(changes) - set(config)
+    if unknown:
+        raise HTTPException(422, f"Unknown settings: {sorted(unknown)}")
+    for key, value in changes.items():
+        config[key] = type(config[key])(value)
+    return {"config": config}
+
+@app.post("/{tenant_id}/oauth2/v2.0/token")
+async def token(tenant_id: str, request: Request):
+    form = await request.form()
+    if form.get("grant_type") != "client_credentials" or not form.get("client_id"):
+        return JSONResponse({"error": "invalid_request"}, status_code=400)
+    return {
+        "token_type": "Bearer",
+        "expires_in": config["token_ttl"],
+        "access_token": f"stub-aad-{tenant_id}-{uuid.uuid4().hex}",
+    }
+
+@app.get("/v1.0/myorg/groups")
+def groups():
+    return {"value": [_workspace(i) for i in range(config["workspaces"])]}
+
+@app.get("/v1.0/myorg/admin/groups")
+def admin_groups(request: Request):
+    if not config["admin_api"]:
+        raise HTTPException(401, {"error": {"code": "PowerBINotAuthorizedException"}})
+    params = request.query_params
+    if "$top" not in params:
+        raise HTTPException(400, {"error": {"code": "InvalidRequest", "message": "$top is required"}})
+    top, skip = int(params["$top"]), int(params.get("$skip", 0))
+    expand = "reports" in params.get("$expand", "")
+    value = []
+    for i in range(skip, min(skip + top, config["workspaces"])):
+        ws = _workspace(i)
+        if expand:
+            ws["reports"] = [_report(i, j) for j in range(config["reports_per_workspace"])]
+        value.append(ws)
+    return {"value": value}
+
+@app.get("/v1.0/myorg/groups/{group_id}/reports")
+def group_reports(group_id: str):
+    ws_index = _workspace_index(group_id)
+    return {"value": [_report(ws_index, i) for i in range(config["reports_per_workspace"])]}
+
+@app.get("/v1.0/myorg/groups/{group_id}/reports/{report_id}")
+def group_report(group_id: str, report_id: str):
+    ws_index = _workspace_index(group_id)
+    for i in range(config["reports_per_workspace"]):
+        if _id("report", ws_index, i) == report_id:
+            return _report(ws_index, i)
+    raise HTTPException(404, {"error": {"code": "PowerBIEntityNotFound"}})
+
+@app.post("/v1.0/myorg/generateToken")
+@app.post("/v1.0/myorg/GenerateToken")
+def generate_token(payload: dict):
+    if not payload.get("reports"):
+        raise HTTPException(400, {"error": {"code": "InvalidRequest"}})
+    expiration = datetime.now(timezone.utc) + timedelta(seconds=config["token_ttl"])
+    return {
+        "token": f"stub-embed-{uuid.uuid4().hex}",
+        "tokenId": str(uuid.uuid4()),
+        "expiration": expiration.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "issuedAt": int(time.time()),
+    }
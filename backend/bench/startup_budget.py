@@ -0,0 +1,86 @@
+# bench/startup_budget.py
+# Checks that a worker boots without touching the database: times a cold
+# "import main" and the lifespan startup in a fresh interpreter, pointed at a
+# database that cannot be reached, and exits non-zero over budget.
+#
+#   python bench/startup_budget.py --import-budget-ms 3000 --startup-budget-ms 250
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET_MS = 3000
+STARTUP_BUDGET_MS = 250
+
+_PROBE = r"""
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def probe():
+    import httpx
+    async with main.app.router.lifespan_context(main.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://probe") as client:
+            health = await client.get("/healthz")
+            ready_start = time.perf_counter()
+            ready = await client.get("/readyz")
+            ready_done = time.perf_counter()
+    return started, health.status_code, ready.status_code, ready_done - ready_start
+
+lifespan_start = time.perf_counter()
+started, health, ready, ready_seconds = asyncio.run(probe())
+print(json.dumps({
+    "import_ms": round((imported - start) * 1000, 1),
+    "startup_ms": round((started - lifespan_start) * 1000, 1),
+    "healthz": health,
+    "readyz": ready,
+    "readyz_ms": round(ready_seconds * 1000, 1),
+}))
+"""
+
+def probe(env):
+    # Runs the probe in a fresh interpreter; also used by test_main.py
+    proc = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when worker startup exceeds its budget.")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--startup-budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--database-url", default="sqlite:////nonexistent/startup-budget.db",
+                        help="deliberately unreachable by default")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, DATABASE_URL=args.database_url, DB_AUTO_MIGRATE="false", LOG_LEVEL="ERROR")
+    if not env.get("FERNET_KEY"):
+        from cryptography.fernet import Fernet
+        env["FERNET_KEY"] = Fernet.generate_key().decode()
+    try:
+        result = probe(env)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if result["import_ms"] > args.import_budget_ms:
+        failures.append(f"import took {result['import_ms']}ms (budget {args.import_budget_ms}ms)")
+    if result["startup_ms"] > args.startup_budget_ms:
+        failures.append(f"lifespan startup took {result['startup_ms']}ms (budget {args.startup_budget_ms}ms)")
+    if result["healthz"] != 200:
+        failures.append(f"/healthz returned {result['healthz']}")
+    for failure in failures:
+        print("FAIL:", failure, file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+# conftest.py
+# Tests run against a throwaway SQLite database; the schema is created by
+# the app lifespan (DB_AUTO_MIGRATE).
+import os
+import tempfile
+from cryptography.fernet import Fernet
+
+_db_dir = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.setdefault("FERNET_KEY", Fernet.generate_key().decode())
+os.environ.setdefault("SQL_SCHEMA", "main")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_dir}/test.db")
+os.environ.setdefault("DB_AUTO_MIGRATE", "true")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
@@ -1,22 +1,219 @@
 # database.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+from starlette.concurrency import run_in_threadpool
+import metrics
 
-DATABASE_URL = (
+# Nothing here connects or even builds an engine at import time; the app
+# lifespan (or manage.py) calls init_engines(). Load .env before importing.
+# Any SQLAlchemy URL, e.g. sqlite:///./local.db for local load testing.
+# Tables are schema-qualified (models.SQL_SCHEMA, default "dbo"), so SQLite
+# needs SQL_SCHEMA=main, or a database ATTACHed as "dbo".
+DATABASE_URL = os.getenv("DATABASE_URL") or (
     f"mssql+pyodbc://{os.getenv('SQL_USER')}:{os.getenv('SQL_PASS')}"
     f"@{os.getenv('SQL_SERVER')}/{os.getenv('SQL_DB')}?driver=ODBC+Driver+17+for+SQL+Server"
 )
-engine = create_engine(DATABASE_URL, fast_executemany=True)
-SessionLocal = sessionmaker(bind=engine)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Recycle connections before SQL Server / load balancers drop idle ones
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Hot read routes use an async engine when enabled; needs the async driver
+# for the URL (aioodbc for SQL Server, aiosqlite for SQLite).
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+ASYNC_DRIVERS = {
+    "mssql": "mssql+aioodbc",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+class PoolMetrics:
+    """Checkout wait times and peak usage for one engine's pool."""
+
+    def __init__(self, name):
+        self.name = name
+        self.pool = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.peak_checked_out = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def attach(self, pool):
+        self.pool = pool
+        event.listen(pool, "checkout", self._on_checkout)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        # Only queue pools count connections (not StaticPool for in-memory SQLite)
+        if not isinstance(self.pool, QueuePool):
+            return
+        checked_out = self.pool.checkedout()
+        if checked_out > self.peak_checked_out:
+            self.peak_checked_out = checked_out
+
+    def stats(self):
+        stats = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+            "peak_checked_out": self.peak_checked_out,
+        }
+        if isinstance(self.pool, QueuePool):
+            capacity = self.pool.size() + max(self.pool._max_overflow, 0)
+            stats.update({
+                "pool_size": self.pool.size(),
+                "max_overflow": self.pool._max_overflow,
+                "checked_out": self.pool.checkedout(),
+                "checked_in": self.pool.checkedin(),
+                "utilization": round(self.pool.checkedout() / capacity, 4) if capacity else 0.0,
+            })
+        return stats
+
+
+def _instrumented(pool_cls, metrics):
+    # Times how long each checkout waits for a free connection
+    class InstrumentedPool(pool_cls):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except PoolTimeoutError:
+                metrics.record_timeout()
+                raise
+            metrics.record_wait(time.perf_counter() - start)
+            return conn
+    return InstrumentedPool
+
+def _engine_kwargs(url, pool_cls, metrics):
+    kwargs = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if url.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # In-memory SQLite lives in a single connection shared by all threads
+            kwargs["poolclass"] = StaticPool
+            return kwargs
+    if url.get_driver_name() == "pyodbc":
+        kwargs["fast_executemany"] = True
+    kwargs.update(
+        poolclass=_instrumented(pool_cls, metrics),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return kwargs
+
+pool_metrics = {"sync": PoolMetrics("sync")}
 Base = declarative_base()
+SessionLocal = sessionmaker()
+engine = None
+async_engine = None
+AsyncSessionLocal = None
+_init_lock = threading.Lock()
+
+def init_engines():
+    global engine, async_engine, AsyncSessionLocal
+    with _init_lock:
+        if engine is not None:
+            return engine
+        url = make_url(DATABASE_URL)
+        sync_engine = create_engine(url, **_engine_kwargs(url, QueuePool, pool_metrics["sync"]))
+        pool_metrics["sync"].attach(sync_engine.pool)
+        metrics.instrument_engine(sync_engine, "sync")
+        SessionLocal.configure(bind=sync_engine)
+
+        if DB_ASYNC:
+            from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+            from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+            async_url = make_url(os.getenv("ASYNC_DATABASE_URL") or url.set(
+                drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+            ))
+            pool_metrics["async"] = PoolMetrics("async")
+            async_engine = create_async_engine(
+                async_url, **_engine_kwargs(async_url, AsyncAdaptedQueuePool, pool_metrics["async"])
+            )
+            pool_metrics["async"].attach(async_engine.sync_engine.pool)
+            metrics.instrument_engine(async_engine.sync_engine, "async")
+            AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+        engine = sync_engine
+        return engine
+
+def get_engine():
+    return engine if engine is not None else init_engines()
+
+async def dispose_engines():
+    global engine, async_engine, AsyncSessionLocal
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        await run_in_threadpool(engine.dispose)
+    engine = async_engine = AsyncSessionLocal = None
+    pool_metrics.pop("async", None)
+
+def ping():
+    # Readiness check: one round trip on a pooled connection
+    with get_engine().connect() as conn:
+        conn.exec_driver_sql("SELECT 1")
 
 def get_db():
+    get_engine()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+class ThreadpoolSession:
+    """Gives a sync Session the awaitable execute() of an AsyncSession."""
+
+    def __init__(self, session):
+        self.session = session
+
+    async def execute(self, statement):
+        # Rows are fetched in the worker thread and handed back buffered
+        frozen = await run_in_threadpool(lambda: self.session.execute(statement).freeze())
+        return frozen()
+
+    async def close(self):
+        await run_in_threadpool(self.session.close)
+
+async def get_read_db():
+    # For read-only routes written against select() statements
+    get_engine()
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            yield session
+    else:
+        session = ThreadpoolSession(SessionLocal())
+        try:
+            yield session
+        finally:
+            await session.close()
+
+def pool_stats():
+    return {name: metrics.stats() for name, metrics in pool_metrics.items()}
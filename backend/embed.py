@@ -1,89 +1,121 @@
 # embed.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from cryptography.fernet import Fernet
+import json
 import os
-import requests
-from models import User, UserCredential
+import asyncio
+import logging
+import powerbi_client
+from models import User, UserDashboardLayout
 from schemas import EmbedReportRequest
-from auth import get_current_user
+from auth import get_current_user, get_stream_user
 from database import get_db
-from fastapi import Request
+from tokens import STREAM_TICKET_TTL, create_stream_ticket
+from embed_renewal import EmbedSession, scheduler as renewal_scheduler
+from powerbi_utils import (
+    get_powerbi_credentials,
+    get_access_token,
+    credential_key,
+    get_cached_embed_token,
+    cache_embed_token,
+    get_cached_report_info,
+    cache_report_info,
+    cache_report_not_found,
+    report_info_flight,
+    REPORT_NOT_FOUND,
+)
 
 router = APIRouter()
+# Seconds between keep-alive comments on idle embed streams
+STREAM_KEEPALIVE = int(os.getenv("EMBED_STREAM_KEEPALIVE", "15"))
+# Info lines are sampled per request (EMBED_LOG_SAMPLE_RATE); never log tokens or bodies
+logger = logging.getLogger("embed")
 
-FERNET_KEY = os.getenv("FERNET_KEY")
-fernet = Fernet(FERNET_KEY.encode())
-
-def get_access_token(client_id, tenant_id, secret):
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
-    token_url = f"{authority}/oauth2/v2.0/token"
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": client_id,
-        "client_secret": secret,
-        "scope": "https://analysis.windows.net/powerbi/api/.default",
+async def generate_embed_token(headers, cred_key, reports, dataset_ids, api_base, force=False):
+    # One token can cover several (group_id, report_id) pairs and datasets.
+    # force skips the cache lookup, for renewals ahead of the cache margin.
+    reports = sorted(set(reports))
+    group_ids = tuple(sorted({group_id for group_id, _ in reports}))
+    report_ids = tuple(report_id for _, report_id in reports)
+    dataset_ids = tuple(sorted({d for d in dataset_ids if d}))
+    cached = None if force else get_cached_embed_token(cred_key, group_ids, report_ids, dataset_ids)
+    if cached is not None:
+        return cached
+    payload = {
+        "reports": [{"id": report_id, "groupId": group_id} for group_id, report_id in reports],
+        "datasets": [{"id": d} for d in dataset_ids],
+        "targetWorkspaces": [{"id": g} for g in group_ids],
+        "accessLevel": "View",
     }
-    resp = requests.post(token_url, data=data, verify=False)
-    resp.raise_for_status()
-    return resp.json()["access_token"]
+    token_resp = await powerbi_client.post(
+        f"{api_base}/generateToken", headers=headers, json=payload, operation="generate_token"
+    )
+    if not token_resp.is_success:
+        logger.warning("generateToken failed", extra={"status": token_resp.status_code, "reports": len(reports)})
+        raise HTTPException(400, "Failed to generate embed token from Power BI")
+    body = token_resp.json()
+    cache_embed_token(cred_key, group_ids, report_ids, dataset_ids, body)
+    return body
+
+async def fetch_report_info(headers, group_id, report_id, api_base, cred_key=None):
+    # Served from the report metadata cache, which /reports listings also fill
+    info = get_cached_report_info(group_id, report_id, cred_key)
+    if info is REPORT_NOT_FOUND:
+        raise HTTPException(400, "Failed to fetch report info from Power BI")
+    if info is not None:
+        return info
+
+    async def load():
+        resp = await powerbi_client.get(
+            f"{api_base}/groups/{group_id}/reports/{report_id}",
+            headers=headers,
+            operation="get_report",
+        )
+        if not resp.is_success:
+            if resp.status_code == 404 and cred_key is not None:
+                cache_report_not_found(cred_key, group_id, report_id)
+            logger.warning(
+                "report info request failed",
+                extra={"status": resp.status_code, "group_id": group_id, "report_id": report_id},
+            )
+            raise HTTPException(400, "Failed to fetch report info from Power BI")
+        body = resp.json()
+        cache_report_info(group_id, report_id, body)
+        return body
+    return await report_info_flight.do((cred_key, group_id, report_id), load)
 
 @router.post("/embed-report")
 async def embed_report(
     req: EmbedReportRequest,
-    request: Request,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
     try:
-        print("--- /embed-report CALLED ---")
-        print("Raw incoming request body:", await request.body())  # Correct usage!
-        print("Parsed Pydantic model:", req.model_dump())
-        cred = db.query(UserCredential).filter_by(user_id=user.id).first()
-        if not cred:
-            raise HTTPException(400, "No Power BI credentials set for user.")
-        client_id, tenant_id = cred.client_id, cred.tenant_id
-        secret = fernet.decrypt(cred.secret_enc.encode()).decode()
-        token = get_access_token(client_id, tenant_id, secret)
-        api_base = "https://api.powerbi.com/v1.0/myorg"
+        client_id, tenant_id, secret = await run_in_threadpool(get_powerbi_credentials, db, user)
+        token = await get_access_token(client_id, tenant_id, secret)
+        api_base = powerbi_client.API_BASE
 
         group_id = req.group_id
         report_id = req.report_id
+        cred_key = credential_key(client_id, tenant_id, secret)
 
         # Fetch report info
         headers = {"Authorization": f"Bearer {token}"}
-        url = f"{api_base}/groups/{group_id}/reports/{report_id}"
-        resp = requests.get(url, headers=headers, timeout=20, verify=False)
-        if not resp.ok:
-            print("Power BI report info response:", resp.text)
-            raise HTTPException(400, "Failed to fetch report info from Power BI")
-        rpt_info = resp.json()
+        rpt_info = await fetch_report_info(headers, group_id, report_id, api_base, cred_key)
         embed_url = rpt_info.get("embedUrl")
         dataset_id = rpt_info.get("datasetId") or req.dataset_id
 
-        # Generate embed token
-        payload = {
-            "reports": [{"id": report_id, "groupId": group_id}],
-            "datasets": [{"id": dataset_id}],
-            "targetWorkspaces": [{"id": group_id}],
-            "accessLevel": "View",
-        }
-        token_resp = requests.post(
-            f"{api_base}/generateToken", headers=headers, json=payload, verify=False
+        # Generate embed token (reused from cache until shortly before it expires)
+        token_body = await generate_embed_token(
+            headers, cred_key, [(group_id, report_id)], [dataset_id], api_base,
+        )
+        embed_token = token_body["token"]
+        logger.info(
+            "embed token issued",
+            extra={"route": "/embed-report", "user_id": user.id, "group_id": group_id, "report_id": report_id},
         )
-        if not token_resp.ok:
-            print("Power BI embed token response:", token_resp.text)
-            raise HTTPException(400, "Failed to generate embed token from Power BI")
-
-        embed_token = token_resp.json()["token"]
-        print({
-            "embed_token": embed_token,
-            "embed_url": embed_url,
-            "report_id": report_id,
-            "group_id": group_id,
-            "dataset_id": dataset_id,
-            "report_name": rpt_info.get("name"),
-        })
         return {
             "embed_token": embed_token,
             "embed_url": embed_url,
@@ -91,68 +123,46 @@ async def embed_report(
             "group_id": group_id,
             "dataset_id": dataset_id,
             "report_name": rpt_info.get("name"),
+            "expiration": token_body.get("expiration"),
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        print("ERROR in /embed-report:", e)
-        traceback.print_exc()
+        logger.exception("embed-report failed", extra={"user_id": user.id, "report_id": req.report_id})
         raise HTTPException(500, f"Internal error in /embed-report: {str(e)}")
     
     
 @router.post("/create-embed")
 async def create_powerbi_embed(
     req: EmbedReportRequest,   # Same schema as your existing one!
-    request: Request,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
     try:
-        print("--- /embed-report CALLED ---")
-        print("Raw incoming request body:", await request.body())  # Correct usage!
-        print("Parsed Pydantic model:", req.model_dump())
-        cred = db.query(UserCredential).filter_by(user_id=user.id).first()
-        if not cred:
-            raise HTTPException(400, "No Power BI credentials set for user.")
-        client_id, tenant_id = cred.client_id, cred.tenant_id
-        secret = fernet.decrypt(cred.secret_enc.encode()).decode()
-        token = get_access_token(client_id, tenant_id, secret)
-        api_base = "https://api.powerbi.com/v1.0/myorg"
+        client_id, tenant_id, secret = await run_in_threadpool(get_powerbi_credentials, db, user)
+        token = await get_access_token(client_id, tenant_id, secret)
+        api_base = powerbi_client.API_BASE
 
         group_id = getattr(req, "group_id", None) or getattr(req, "workspace_id", None)
         if not group_id:
             raise HTTPException(422, "Missing group_id/workspace_id in payload.")
 
         # Fetch report info (get embedUrl dynamically)
+        cred_key = credential_key(client_id, tenant_id, secret)
         headers = {"Authorization": f"Bearer {token}"}
-        url = f"{api_base}/groups/{group_id}/reports/{req.report_id}"
-        resp = requests.get(
-            url,
-            headers=headers,
-            timeout=20,
-            verify=False,
-        )
-        if not resp.ok:
-            print("Power BI report info response:", resp.text)
-            raise HTTPException(400, "Failed to fetch report info from Power BI")
-        rpt_info = resp.json()
+        rpt_info = await fetch_report_info(headers, group_id, req.report_id, api_base, cred_key)
         embed_url = rpt_info.get("embedUrl")
         dataset_id = rpt_info.get("datasetId") or req.dataset_id
 
-        # Generate embed token
-        payload = {
-            "reports": [{"id": req.report_id, "groupId": group_id}],
-            "datasets": [{"id": dataset_id}],
-            "targetWorkspaces": [{"id": group_id}],
-            "accessLevel": "View",
-        }
-        token_resp = requests.post(
-            f"{api_base}/generateToken", headers=headers, json=payload, verify=False
+        # Generate embed token (reused from cache until shortly before it expires)
+        token_body = await generate_embed_token(
+            headers, cred_key, [(group_id, req.report_id)], [dataset_id], api_base,
+        )
+        embed_token = token_body["token"]
+        logger.info(
+            "embed token issued",
+            extra={"route": "/create-embed", "user_id": user.id, "group_id": group_id, "report_id": req.report_id},
         )
-        if not token_resp.ok:
-            print("Power BI embed token response:", token_resp.text)
-            raise HTTPException(400, "Failed to generate embed token from Power BI")
-
-        embed_token = token_resp.json()["token"]
         return {
             "embed_token": embed_token,
             "embed_url": embed_url,
@@ -160,9 +170,148 @@ async def create_powerbi_embed(
             "group_id": group_id,
             "dataset_id": dataset_id,
             "report_name": rpt_info.get("name"),
+            "expiration": token_body.get("expiration"),
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        print("ERROR in /create-embed:", e)
-        traceback.print_exc()
-        raise HTTPException(500, f"Internal error in /create-embed: {str(e)}")
\ No newline at end of file
+        logger.exception("create-embed failed", extra={"user_id": user.id, "report_id": req.report_id})
+        raise HTTPException(500, f"Internal error in /create-embed: {str(e)}")
+
+
+def _load_layout(db, user, layout_id):
+    layout = (
+        db.query(UserDashboardLayout)
+        .filter_by(user_id=user.id, id=layout_id)
+        .first()
+    )
+    if not layout:
+        raise HTTPException(404, "Layout not found.")
+    return json.loads(layout.layout_json or "[]"), get_powerbi_credentials(db, user)
+
+async def _embed_layout(db, user, layout_id):
+    # Returns the layout embed payload and the EmbedSession that renews it
+    # (None when no report resolved).
+    cards, credentials = await run_in_threadpool(_load_layout, db, user, layout_id)
+    token = await get_access_token(*credentials)
+    api_base = powerbi_client.API_BASE
+    headers = {"Authorization": f"Bearer {token}"}
+    cred_key = credential_key(*credentials)
+
+    # Fetch report info for every distinct report concurrently
+    targets = sorted({(c.get("group_id"), c.get("report_id")) for c in cards if c.get("report_id")})
+    infos, errors = {}, {}
+
+    async def fetch(target):
+        try:
+            return target, await fetch_report_info(headers, target[0], target[1], api_base, cred_key), None
+        except HTTPException as e:
+            return target, None, e.detail
+        except Exception as e:
+            return target, None, str(e)
+
+    for target, info, error in await asyncio.gather(*(fetch(t) for t in targets)):
+        if error is None:
+            infos[target] = info
+        else:
+            errors[target] = error
+
+    # One embed token covering every report that resolved
+    card_datasets = {(c.get("group_id"), c.get("report_id")): c.get("dataset_id") for c in cards}
+    dataset_by_target = {
+        target: info.get("datasetId") or card_datasets.get(target)
+        for target, info in infos.items()
+    }
+    token_body = session = None
+    if infos:
+        token_body = await generate_embed_token(
+            headers, cred_key, list(infos), dataset_by_target.values(), api_base,
+        )
+        session = EmbedSession(
+            user.id, layout_id, credentials, cred_key,
+            sorted(infos), dataset_by_target.values(), token_body,
+        )
+
+    reports = []
+    for card in cards:
+        target = (card.get("group_id"), card.get("report_id"))
+        info = infos.get(target)
+        if info is None:
+            continue
+        reports.append({
+            "embed_token": token_body["token"],
+            "embed_url": info.get("embedUrl"),
+            "report_id": target[1],
+            "group_id": target[0],
+            "dataset_id": dataset_by_target[target],
+            "report_name": info.get("name"),
+            "expiration": token_body.get("expiration"),
+        })
+    payload = {
+        "layout_id": layout_id,
+        "expiration": token_body.get("expiration") if token_body else None,
+        "reports": reports,
+        "errors": [
+            {"report_id": report_id, "group_id": group_id, "error": error}
+            for (group_id, report_id), error in errors.items()
+        ],
+    }
+    return payload, session
+
+
+@router.post("/dashboard-layout/{layout_id}/embed")
+async def embed_dashboard_layout(
+    layout_id: int,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    payload, _ = await _embed_layout(db, user, layout_id)
+    return payload
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/dashboard-layout/{layout_id}/embed/stream-ticket")
+def create_layout_stream_ticket(layout_id: int, request: Request, user: User = Depends(get_current_user)):
+    # Pass as ?ticket= when opening the stream with EventSource
+    path = request.url_for("stream_dashboard_layout_embed", layout_id=layout_id).path
+    return {"ticket": create_stream_ticket(user, path), "expires_in": STREAM_TICKET_TTL}
+
+@router.get("/dashboard-layout/{layout_id}/embed/stream")
+async def stream_dashboard_layout_embed(
+    layout_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_stream_user),
+):
+    # Server-Sent Events: an "embed" event with the same payload as
+    # POST /dashboard-layout/{id}/embed, then a "token" event (or
+    # "renewal_error") whenever the server renews the layout's embed token.
+    payload, session = await _embed_layout(db, user, layout_id)
+    # The stream stays open for hours; give the pooled connection back now
+    db.close()
+
+    async def events():
+        queue = asyncio.Queue()
+        tracked = renewal_scheduler.subscribe(session, queue) if session is not None else None
+        try:
+            yield _sse("embed", payload)
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse(event, data)
+        finally:
+            if tracked is not None:
+                renewal_scheduler.unsubscribe(tracked, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
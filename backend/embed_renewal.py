@@ -0,0 +1,216 @@
+# embed_renewal.py
+# Keeps embed tokens of open layout streams fresh. Every connected layout
+# registers an EmbedSession; one scheduler task renews sessions shortly
+# before their token expires, batching all sessions due for the same
+# credential into shared generateToken calls, and pushes the new token to
+# each session's subscribers.
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+import powerbi_client
+
+# Renew this many seconds before the token expires
+RENEW_BEFORE = int(os.getenv("EMBED_RENEW_BEFORE", "300"))
+# Sessions due within this window of the first due one renew in the same batch
+RENEW_COALESCE = int(os.getenv("EMBED_RENEW_COALESCE", "120"))
+# Reports per generateToken call when batching several layouts
+RENEW_MAX_REPORTS = int(os.getenv("EMBED_RENEW_MAX_REPORTS", "50"))
+RENEW_CONCURRENCY = int(os.getenv("EMBED_RENEW_CONCURRENCY", "4"))
+RENEW_RETRY_DELAY = int(os.getenv("EMBED_RENEW_RETRY_DELAY", "30"))
+
+logger = logging.getLogger("embed_renewal")
+
+
+def expiration_timestamp(expiration):
+    # Power BI returns e.g. "2024-05-01T12:00:00Z"
+    try:
+        parsed = datetime.fromisoformat(expiration.replace("Z", "+00:00"))
+    except (AttributeError, TypeError, ValueError):
+        return time.time()
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class EmbedSession:
+    """One layout embedded for one user, shared by all of that user's open streams."""
+
+    def __init__(self, user_id, layout_id, credentials, cred_key, targets, datasets, token_body):
+        self.user_id = user_id
+        self.layout_id = layout_id
+        self.credentials = credentials
+        self.cred_key = cred_key
+        self.targets = list(targets)
+        self.datasets = list(datasets)
+        self.subscribers = set()
+        self.set_token(token_body)
+
+    def set_token(self, token_body):
+        self.token_body = token_body
+        self.expires_at = expiration_timestamp(token_body.get("expiration"))
+        # Small jitter keeps sessions opened together from renewing in lockstep
+        self.renew_at = self.expires_at - RENEW_BEFORE - random.uniform(0, RENEW_BEFORE / 10)
+
+    def token_event(self):
+        return {
+            "layout_id": self.layout_id,
+            "embed_token": self.token_body["token"],
+            "expiration": self.token_body.get("expiration"),
+            "report_ids": [report_id for _, report_id in self.targets],
+        }
+
+    def publish(self, event, data):
+        for queue in self.subscribers:
+            queue.put_nowait((event, data))
+
+
+class RenewalScheduler:
+    def __init__(self):
+        self.sessions = {}
+        self._wakeup = None
+        self._task = None
+        self._renewals = 0
+        self._failures = 0
+
+    def start(self):
+        # Created here so the event belongs to the app's running loop
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, session, queue):
+        # Returns the session actually tracked for (user, layout)
+        key = (session.user_id, session.layout_id)
+        current = self.sessions.get(key)
+        if current is None:
+            self.sessions[key] = current = session
+        elif current.cred_key != session.cred_key or current.targets != session.targets:
+            # The layout or credentials changed since the session started;
+            # updated in place so every stream keeps holding the tracked object
+            current.credentials = session.credentials
+            current.cred_key = session.cred_key
+            current.targets = session.targets
+            current.datasets = session.datasets
+            current.set_token(session.token_body)
+        elif session.expires_at < current.expires_at:
+            # The joiner got an older cached token; hand it the session's newest
+            queue.put_nowait(("token", current.token_event()))
+        current.subscribers.add(queue)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return current
+
+    def unsubscribe(self, session, queue):
+        key = (session.user_id, session.layout_id)
+        session.subscribers.discard(queue)
+        current = self.sessions.get(key)
+        if current is not None:
+            current.subscribers.discard(queue)
+            if not current.subscribers:
+                del self.sessions[key]
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "subscribers": sum(len(s.subscribers) for s in self.sessions.values()),
+            "renewals": self._renewals,
+            "failures": self._failures,
+        }
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(RENEW_CONCURRENCY)
+        running = set()
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            if not self.sessions:
+                await self._wakeup.wait()
+                continue
+            first_due = min(s.renew_at for s in self.sessions.values())
+            if first_due > now:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), first_due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Everything due soon is renewed now, grouped per credential
+            batches = {}
+            for session in self.sessions.values():
+                if session.renew_at <= now + RENEW_COALESCE:
+                    batches.setdefault(session.cred_key, []).append(session)
+                    # Not picked again while its renewal is in flight
+                    session.renew_at = now + RENEW_RETRY_DELAY
+            for sessions in batches.values():
+                task = asyncio.create_task(self._renew(semaphore, sessions))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+    async def _renew(self, semaphore, sessions):
+        from embed import generate_embed_token
+        from powerbi_utils import get_access_token
+
+        async with semaphore:
+            client_id, tenant_id, secret = sessions[0].credentials
+            try:
+                token = await get_access_token(client_id, tenant_id, secret)
+            except Exception as e:
+                self._fail(sessions, e)
+                self._wakeup.set()
+                return
+            headers = {"Authorization": f"Bearer {token}"}
+            for chunk in _chunks(sessions):
+                targets = [t for s in chunk for t in s.targets]
+                datasets = [d for s in chunk for d in s.datasets]
+                try:
+                    body = await generate_embed_token(
+                        headers, sessions[0].cred_key, targets, datasets, powerbi_client.API_BASE, force=True,
+                    )
+                except Exception as e:
+                    self._fail(chunk, e)
+                    continue
+                self._renewals += 1
+                for session in chunk:
+                    session.set_token(body)
+                    session.publish("token", session.token_event())
+            logger.info("embed tokens renewed", extra={"sessions": len(sessions)})
+        # New renew_at times; let the scheduler recompute its next wakeup
+        self._wakeup.set()
+
+    def _fail(self, sessions, error):
+        self._failures += 1
+        logger.warning("embed token renewal failed: %s", error, extra={"sessions": len(sessions)})
+        for session in sessions:
+            session.renew_at = time.time() + RENEW_RETRY_DELAY
+            session.publish("renewal_error", {
+                "layout_id": session.layout_id,
+                "retry_in": RENEW_RETRY_DELAY,
+                "expiration": session.token_body.get("expiration"),
+            })
+
+
+def _chunks(sessions):
+    # Groups whole sessions into generateToken calls of at most RENEW_MAX_REPORTS reports
+    chunk, size = [], 0
+    for session in sessions:
+        if chunk and size + len(session.targets) > RENEW_MAX_REPORTS:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(session)
+        size += len(session.targets)
+    if chunk:
+        yield chunk
+
+
+scheduler = RenewalScheduler()
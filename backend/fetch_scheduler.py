@@ -0,0 +1,101 @@
+# fetch_scheduler.py
+# Process-wide limits for Power BI listing fan-out. Every workspace fetch
+# takes a slot from a global bound and from its tenant's limiter. Tenant
+# limits adapt AIMD-style: each success under the latency target adds about
+# one slot per window of requests, and a 429/503 (or a slow or timed-out
+# call) cuts the limit multiplicatively.
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+MAX_CONCURRENCY = int(os.getenv("REPORTS_FETCH_MAX_CONCURRENCY", "64"))
+TENANT_INITIAL = float(os.getenv("REPORTS_TENANT_CONCURRENCY_INITIAL", "8"))
+TENANT_MIN = float(os.getenv("REPORTS_TENANT_CONCURRENCY_MIN", "1"))
+TENANT_MAX = float(os.getenv("REPORTS_TENANT_CONCURRENCY_MAX", "32"))
+# Calls slower than this count as congestion
+LATENCY_TARGET = float(os.getenv("REPORTS_FETCH_LATENCY_TARGET", "2"))
+THROTTLE_DECREASE = 0.5
+LATENCY_DECREASE = 0.8
+
+
+class TenantLimiter:
+    def __init__(self):
+        self.limit = TENANT_INITIAL
+        self.in_flight = 0
+        self.throttled = 0
+        self._cond = asyncio.Condition()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_response(self, status, seconds):
+        if status in (429, 503):
+            self.throttled += 1
+            self._decrease(THROTTLE_DECREASE, seconds)
+        elif seconds > LATENCY_TARGET:
+            self._decrease(LATENCY_DECREASE, seconds)
+        elif status < 500:
+            self.limit = min(TENANT_MAX, self.limit + 1 / self.limit)
+
+    def on_timeout(self, seconds):
+        self._decrease(LATENCY_DECREASE, seconds)
+
+    def _decrease(self, factor, seconds):
+        # Calls that were already in flight report the same congestion; cut
+        # at most once per round trip.
+        now = time.monotonic()
+        if now - self._last_decrease < max(seconds, 0.1):
+            return
+        self._last_decrease = now
+        self.limit = max(TENANT_MIN, self.limit * factor)
+
+
+class FetchScheduler:
+    def __init__(self):
+        self._loop = None
+        self._global = None
+        self._tenants = {}
+
+    def _bind(self):
+        # asyncio primitives belong to one event loop; start over on a new one
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._global = asyncio.Semaphore(MAX_CONCURRENCY)
+            self._tenants = {}
+
+    @asynccontextmanager
+    async def slot(self, tenant_id):
+        # Yields the limiter; report each upstream attempt to on_response
+        self._bind()
+        limiter = self._tenants.get(tenant_id)
+        if limiter is None:
+            limiter = self._tenants[tenant_id] = TenantLimiter()
+        await limiter.acquire()
+        try:
+            async with self._global:
+                yield limiter
+        finally:
+            await limiter.release()
+
+    def stats(self):
+        return {
+            tenant_id: {
+                "limit": round(limiter.limit, 2),
+                "in_flight": limiter.in_flight,
+                "throttled": limiter.throttled,
+            }
+            for tenant_id, limiter in self._tenants.items()
+        }
+
+
+scheduler = FetchScheduler()
@@ -0,0 +1,107 @@
+# json_patch.py
+# Minimal RFC 6902 (JSON Patch) applier over plain dicts/lists.
+import copy
+
+
+class JsonPatchError(ValueError):
+    pass
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    pass
+
+
+def parse_pointer(path):
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer '{path}'.")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+def _index(target, token, allow_end):
+    if allow_end and token == "-":
+        return len(target)
+    # isdigit alone also accepts non-ASCII digits such as "²"
+    if not (token.isascii() and token.isdigit()) or (len(token) > 1 and token[0] == "0"):
+        raise JsonPatchError(f"Invalid array index '{token}'.")
+    index = int(token)
+    if index > len(target) or (index == len(target) and not allow_end):
+        raise JsonPatchError(f"Array index {index} out of range.")
+    return index
+
+def _get(doc, tokens):
+    target = doc
+    for token in tokens:
+        if isinstance(target, list):
+            target = target[_index(target, token, allow_end=False)]
+        elif isinstance(target, dict) and token in target:
+            target = target[token]
+        else:
+            raise JsonPatchError(f"Path '/{'/'.join(tokens)}' does not exist.")
+    return target
+
+def _parent(doc, tokens):
+    if not tokens:
+        raise JsonPatchError("Operations on the document root are not supported.")
+    parent = _get(doc, tokens[:-1])
+    if not isinstance(parent, (list, dict)):
+        raise JsonPatchError(f"Path '/{'/'.join(tokens)}' does not exist.")
+    return parent, tokens[-1]
+
+def _add(doc, tokens, value):
+    parent, key = _parent(doc, tokens)
+    if isinstance(parent, list):
+        parent.insert(_index(parent, key, allow_end=True), value)
+    else:
+        parent[key] = value
+
+def _remove(doc, tokens):
+    parent, key = _parent(doc, tokens)
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, key, allow_end=False))
+    if key not in parent:
+        raise JsonPatchError(f"Path '/{'/'.join(tokens)}' does not exist.")
+    return parent.pop(key)
+
+def _replace(doc, tokens, value):
+    parent, key = _parent(doc, tokens)
+    if isinstance(parent, list):
+        parent[_index(parent, key, allow_end=False)] = value
+    elif key in parent:
+        parent[key] = value
+    else:
+        raise JsonPatchError(f"Path '/{'/'.join(tokens)}' does not exist.")
+
+# Applies one {"op", "path", ["value"], ["from"]} operation to doc in place.
+def apply_operation(doc, operation):
+    op = operation.get("op")
+    tokens = parse_pointer(operation.get("path", ""))
+    if op in ("add", "replace", "test") and "value" not in operation:
+        raise JsonPatchError(f"'{op}' operation requires a value.")
+    if op == "add":
+        _add(doc, tokens, copy.deepcopy(operation["value"]))
+    elif op == "remove":
+        _remove(doc, tokens)
+    elif op == "replace":
+        _replace(doc, tokens, copy.deepcopy(operation["value"]))
+    elif op in ("move", "copy"):
+        if "from" not in operation:
+            raise JsonPatchError(f"'{op}' operation requires 'from'.")
+        from_tokens = parse_pointer(operation["from"])
+        if op == "move":
+            if tokens[:len(from_tokens)] == from_tokens and tokens != from_tokens:
+                raise JsonPatchError("Cannot move a value into one of its children.")
+            _add(doc, tokens, _remove(doc, from_tokens))
+        else:
+            _add(doc, tokens, copy.deepcopy(_get(doc, from_tokens)))
+    elif op == "test":
+        if _get(doc, tokens) != operation["value"]:
+            raise JsonPatchTestFailed(f"Test failed at '{operation['path']}'.")
+    else:
+        raise JsonPatchError(f"Unsupported operation '{op}'.")
+    return doc
+
+def apply_patch(doc, operations):
+    for operation in operations:
+        apply_operation(doc, operation)
+    return doc
@@ -0,0 +1,35 @@
+# layout_storage.py
+# Encoding of UserDashboardLayout.layout_data. Rows keep their JSON either as
+# plain text in layout_data or compressed in layout_data_z, never both.
+import os
+import zlib
+
+# Off by default; when on, writes of at least COMPRESS_MIN_BYTES are compressed
+COMPRESS_LAYOUTS = os.getenv("LAYOUT_COMPRESSION", "false").lower() in ("1", "true", "yes")
+COMPRESS_MIN_BYTES = int(os.getenv("LAYOUT_COMPRESSION_MIN_BYTES", "4096"))
+COMPRESS_LEVEL = int(os.getenv("LAYOUT_COMPRESSION_LEVEL", "6"))
+
+# First byte of every layout_data_z value, so other codecs can be added later
+FORMAT_ZLIB = b"\x01"
+
+
+def should_compress(text):
+    return COMPRESS_LAYOUTS and text is not None and len(text) >= COMPRESS_MIN_BYTES
+
+def compress(text):
+    return FORMAT_ZLIB + zlib.compress(text.encode("utf-8"), COMPRESS_LEVEL)
+
+def decompress(blob):
+    marker, payload = blob[:1], blob[1:]
+    if marker == FORMAT_ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown layout_data format marker {marker!r}.")
+
+def encode(text):
+    # Returns the (layout_data, layout_data_z) pair to store
+    if should_compress(text):
+        return None, compress(text)
+    return text, None
+
+def decode(text, blob):
+    return decompress(blob) if blob is not None else text
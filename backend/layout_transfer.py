@@ -0,0 +1,270 @@
+# layout_transfer.py
+# Bulk NDJSON export and import of dashboard layouts, one layout per line.
+# Export lines carry everything import needs, so a file exported from one
+# environment can be imported into another as-is.
+import json
+import logging
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+import layout_storage
+from auth import get_current_user, is_admin_username
+from database import SessionLocal, get_db, get_engine
+from layouts import COMMENT_FIELDS, _dump_layout_data, _sent_comments
+from models import LayoutReportComment, User, UserDashboardLayout
+from schemas import LayoutImportModel
+
+EXPORT_BATCH_SIZE = int(os.getenv("LAYOUT_EXPORT_BATCH_SIZE", "500"))
+IMPORT_BATCH_SIZE = int(os.getenv("LAYOUT_IMPORT_BATCH_SIZE", "500"))
+# Per-line errors listed in the import report; the counts stay exact
+IMPORT_MAX_ERRORS = 1000
+NDJSON = "application/x-ndjson"
+
+router = APIRouter()
+logger = logging.getLogger("layout_transfer")
+
+L = UserDashboardLayout.__table__
+C = LayoutReportComment.__table__
+
+
+def _batch_comments(db, layout_ids):
+    # {layout_id: {report_id: [comment]}} for one export batch
+    comments = {}
+    rows = db.execute(
+        select(C.c.layout_id, C.c.report_id, *(C.c[f] for f in COMMENT_FIELDS))
+        .where(C.c.layout_id.in_(layout_ids))
+        .order_by(C.c.layout_id, C.c.report_id, C.c.id)
+    )
+    for row in rows:
+        comments.setdefault(row.layout_id, {}).setdefault(row.report_id, []).append(
+            {f: getattr(row, f) for f in COMMENT_FIELDS}
+        )
+    return comments
+
+def _export_lines(user_id, include_comments):
+    # Keyset batches by id rather than one open server-side cursor: each batch
+    # is its own short transaction, and the comment lookup can run on the same
+    # connection (SQL Server can't while a cursor is open without MARS).
+    # Memory stays at one batch however many layouts there are.
+    get_engine()
+    db = SessionLocal()
+    try:
+        last_id = 0
+        while True:
+            query = (
+                select(
+                    L.c.id, L.c.layout_name, L.c.description, L.c.is_favorite, L.c.created_at,
+                    L.c.layout_data, L.c.layout_data_z, User.username,
+                )
+                .outerjoin(User, User.id == L.c.user_id)
+                .where(L.c.id > last_id)
+                .order_by(L.c.id)
+                .limit(EXPORT_BATCH_SIZE)
+            )
+            if user_id is not None:
+                query = query.where(L.c.user_id == user_id)
+            rows = db.execute(query).all()
+            comments = _batch_comments(db, [row.id for row in rows]) if include_comments and rows else {}
+            db.commit()
+
+            lines = []
+            for row in rows:
+                layout_json = layout_storage.decode(row.layout_data, row.layout_data_z) or "[]"
+                if include_comments:
+                    by_report = comments.get(row.id, {})
+                    items = json.loads(layout_json)
+                    for item in items:
+                        item["comments"] = by_report.get(item.get("report_id"), [])
+                    layout_json = json.dumps(items)
+                meta = json.dumps(jsonable_encoder({
+                    "layout_name": row.layout_name,
+                    "description": row.description,
+                    "is_favorite": bool(row.is_favorite),
+                    "created_at": row.created_at,
+                    "username": row.username,
+                }))
+                # Stored layout text is spliced in as-is, as in layouts._layout_response
+                lines.append(f'{meta[:-1]}, "layout_data": {layout_json}}}\n')
+            if lines:
+                yield "".join(lines)
+            if len(rows) < EXPORT_BATCH_SIZE:
+                return
+            last_id = rows[-1].id
+    finally:
+        db.close()
+
+@router.get("/dashboard-layouts/export")
+def export_dashboard_layouts(
+    all_users: bool = Query(False),
+    include_comments: bool = Query(True),
+    user = Depends(get_current_user),
+):
+    if all_users and not is_admin_username(user.username):
+        raise HTTPException(403, "Admin access required.")
+    return StreamingResponse(
+        _export_lines(None if all_users else user.id, include_comments),
+        media_type=NDJSON,
+        headers={"Content-Disposition": 'attachment; filename="dashboard-layouts.ndjson"'},
+    )
+
+
+def _line_error(report, line_no, error):
+    report["failed"] += 1
+    if len(report["errors"]) < IMPORT_MAX_ERRORS:
+        report["errors"].append({"line": line_no, "error": error})
+    else:
+        report["errors_truncated"] = True
+
+def _resolve_users(db, user, admin, parsed, report):
+    # Admins import into the account named by "username"; everyone else
+    # always imports into their own account.
+    names = {m.username for _, m in parsed if admin and m.username and m.username != user.username}
+    ids = dict(db.execute(select(User.username, User.id).where(User.username.in_(names))).all()) if names else {}
+    resolved = []
+    for line_no, model in parsed:
+        if admin and model.username and model.username != user.username:
+            if model.username not in ids:
+                _line_error(report, line_no, f"Unknown user '{model.username}'.")
+                continue
+            resolved.append((line_no, ids[model.username], model))
+        else:
+            resolved.append((line_no, user.id, model))
+    return resolved
+
+def _existing_ids(db, entries):
+    rows = db.execute(
+        select(L.c.id, L.c.user_id, L.c.layout_name)
+        .where(
+            L.c.user_id.in_({user_id for user_id, _ in entries}),
+            L.c.layout_name.in_({name for _, name in entries}),
+        )
+        # Lowest id last, so it wins like .first() does on save
+        .order_by(L.c.id.desc())
+    )
+    return {(row.user_id, row.layout_name): row.id for row in rows}
+
+def _import_batch(db: Session, user, admin, batch, report):
+    parsed = []
+    for line_no, raw in batch:
+        try:
+            parsed.append((line_no, LayoutImportModel.model_validate_json(raw)))
+        except ValidationError as e:
+            _line_error(report, line_no, e.errors(include_url=False, include_context=False))
+
+    # Later lines for the same (user, layout_name) replace earlier ones
+    latest = {}
+    for line_no, user_id, model in _resolve_users(db, user, admin, parsed, report):
+        key = (user_id, model.layout_name)
+        if key in latest:
+            _line_error(report, latest[key][0], f"Superseded by line {line_no}.")
+        latest[key] = (line_no, model)
+    if not latest:
+        return
+
+    try:
+        existing = _existing_ids(db, latest)
+        inserts, updates = {}, []
+        for (user_id, name), (line_no, model) in latest.items():
+            layout_data, layout_data_z = layout_storage.encode(_dump_layout_data(model.layout_data))
+            values = {
+                "description": model.description,
+                "is_favorite": model.is_favorite,
+                "layout_data": layout_data,
+                "layout_data_z": layout_data_z,
+            }
+            if (user_id, name) in existing:
+                updates.append({"b_id": existing[(user_id, name)], **{f"b_{k}": v for k, v in values.items()}})
+            else:
+                row = {"user_id": user_id, "layout_name": name, **values}
+                if model.created_at is not None:
+                    row["created_at"] = model.created_at
+                # executemany needs the same columns in every row
+                inserts.setdefault(tuple(row), []).append(row)
+
+        # One executemany per statement (fast_executemany on SQL Server)
+        for rows in inserts.values():
+            db.execute(insert(L), rows)
+        if updates:
+            db.execute(
+                update(L)
+                .where(L.c.id == bindparam("b_id"))
+                .values(
+                    description=bindparam("b_description"),
+                    is_favorite=bindparam("b_is_favorite"),
+                    layout_data=bindparam("b_layout_data"),
+                    layout_data_z=bindparam("b_layout_data_z"),
+                    version=L.c.version + 1,
+                    updated_at=func.now(),
+                ),
+                updates,
+            )
+
+        # Comments follow save semantics: sent lists replace those reports' comments
+        sent = {key: _sent_comments(model.layout_data) for key, (_, model) in latest.items()}
+        sent = {key: comments for key, comments in sent.items() if comments}
+        if sent:
+            layout_ids = existing if not inserts else _existing_ids(db, sent)
+            replaced = [
+                {"b_layout_id": layout_ids[key], "b_report_id": report_id}
+                for key, comments in sent.items()
+                for report_id in comments
+            ]
+            db.execute(
+                delete(C).where(C.c.layout_id == bindparam("b_layout_id"), C.c.report_id == bindparam("b_report_id")),
+                replaced,
+            )
+            rows = [
+                {"layout_id": layout_ids[key], "report_id": report_id, **{f: c.get(f) for f in COMMENT_FIELDS}}
+                for key, comments in sent.items()
+                for report_id, report_comments in comments.items()
+                for c in report_comments
+            ]
+            if rows:
+                db.execute(insert(C), rows)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.exception("layout import batch failed", extra={"user_id": user.id, "lines": len(latest)})
+        for line_no, _ in latest.values():
+            _line_error(report, line_no, f"Batch failed: {type(e).__name__}")
+        return
+    report["inserted"] += sum(len(rows) for rows in inserts.values())
+    report["updated"] += len(updates)
+
+@router.post("/dashboard-layouts/import")
+async def import_dashboard_layouts(
+    request: Request,
+    db: Session = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    # The body is read as it arrives and written IMPORT_BATCH_SIZE lines at a
+    # time, each batch in its own transaction. A failed batch is rolled back
+    # and reported line by line; later batches still run.
+    admin = is_admin_username(user.username)
+    report = {"lines": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    batch, buffer = [], b""
+
+    async def flush():
+        nonlocal batch
+        if batch:
+            await run_in_threadpool(_import_batch, db, user, admin, batch, report)
+            batch = []
+
+    async for chunk in request.stream():
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            report["lines"] += 1
+            if line.strip():
+                batch.append((report["lines"], line))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await flush()
+    if buffer.strip():
+        report["lines"] += 1
+        batch.append((report["lines"], buffer))
+    await flush()
+    return report
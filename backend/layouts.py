@@ -1,14 +1,144 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import and_, or_, insert, func, select
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.orm.exc import StaleDataError
+from pydantic import TypeAdapter, ValidationError
+from typing import List, Optional
+from datetime import datetime
+import base64
+import hashlib
 import json
-from models import UserDashboardLayout
-from schemas import DashboardLayoutModel, UpdateCommentsRequest
+from models import User, UserDashboardLayout, LayoutReportComment
+from schemas import (
+    DashboardLayoutModel,
+    LayoutReportModel,
+    PatchOperation,
+    UpdateCommentsRequest,
+    ReportComment,
+)
+from json_patch import JsonPatchError, JsonPatchTestFailed, _index, apply_operation, parse_pointer
 from auth import get_current_user
-from database import get_db
+from database import get_db, get_read_db
 
 router = APIRouter()
 
+COMMENT_FIELDS = ("text", "author", "author_id", "date")
+
+_layout_items = TypeAdapter(List[LayoutReportModel])
+
+# Comments live in layout_report_comments keyed by (layout_id, report_id),
+# never inside layout_data, so editing one never rewrites the layout blob.
+def _sent_comments(items):
+    # {report_id: comments} for items that sent comments
+    return {
+        item.report_id: [c.model_dump() for c in item.comments or []]
+        for item in items
+        if "comments" in item.model_fields_set
+    }
+
+def _dump_layout_data(items):
+    # Serialized straight from the models, without building dicts first
+    return _layout_items.dump_json(items, exclude={"__all__": {"comments"}}).decode()
+
+def _layout_response(fields, layout_json, headers=None):
+    # Splices the stored layout_data text into the body as-is instead of
+    # parsing it only to have it re-encoded.
+    meta = json.dumps(jsonable_encoder(fields))
+    body = f'{meta[:-1]}, "layout_data": {layout_json or "[]"}}}'
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _replace_comments(db: Session, layout_id, comments_by_report):
+    if not comments_by_report:
+        return
+    (
+        db.query(LayoutReportComment)
+        .filter(
+            LayoutReportComment.layout_id == layout_id,
+            LayoutReportComment.report_id.in_(list(comments_by_report)),
+        )
+        .delete(synchronize_session=False)
+    )
+    rows = [
+        {"layout_id": layout_id, "report_id": report_id, **{f: c.get(f) for f in COMMENT_FIELDS}}
+        for report_id, comments in comments_by_report.items()
+        for c in comments
+    ]
+    if rows:
+        db.execute(insert(LayoutReportComment), rows)
+
+def _comment_dict(comment):
+    return {"id": comment.id, **{f: getattr(comment, f) for f in COMMENT_FIELDS}}
+
+async def _merge_comments(db, layout_id, layout_data):
+    comments = {}
+    result = await db.execute(
+        select(LayoutReportComment)
+        .where(LayoutReportComment.layout_id == layout_id)
+        .order_by(LayoutReportComment.report_id, LayoutReportComment.id)
+    )
+    for c in result.scalars():
+        comments.setdefault(c.report_id, []).append(_comment_dict(c))
+    for item in layout_data:
+        item["comments"] = comments.get(item.get("report_id"), [])
+    return layout_data
+
+def _owned_layout_exists(db: Session, user, layout_id):
+    return (
+        db.query(UserDashboardLayout.id)
+        .filter_by(user_id=user.id, id=layout_id)
+        .first()
+        is not None
+    )
+
+def _require_layout_report(db: Session, user, layout_id, report_id):
+    # Comments are only stored for reports that are on the layout
+    layout = (
+        db.query(UserDashboardLayout)
+        .filter_by(user_id=user.id, id=layout_id)
+        .first()
+    )
+    if not layout:
+        raise HTTPException(404, "Layout not found.")
+    if not any(item.get("report_id") == report_id for item in json.loads(layout.layout_json or "[]")):
+        raise HTTPException(404, "Report not found in layout.")
+
+# Layout ETags are "<id>.<version>", plus ".<count>.<max id>" of the layout's
+# comments when they are merged in, since comment writes don't bump version.
+def layout_etag(layout_id, version, comment_state=None):
+    if comment_state is None:
+        return f'"{layout_id}.{version}"'
+    count, max_id = comment_state
+    return f'"{layout_id}.{version}.{count}.{max_id or 0}"'
+
+async def _comment_state(db, layout_id):
+    result = await db.execute(
+        select(func.count(LayoutReportComment.id), func.max(LayoutReportComment.id))
+        .where(LayoutReportComment.layout_id == layout_id)
+    )
+    return tuple(result.one())
+
+def _etag_list(header):
+    return [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in _etag_list(if_none_match)
+
+def _not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+def _check_if_match(if_match, layout):
+    # Accepts any ETag issued for this layout version, or a bare version number
+    if if_match is None or if_match.strip() == "*":
+        return
+    for tag in _etag_list(if_match):
+        parts = tag.strip('"').split(".")
+        if parts == [str(layout.version)] or parts[:2] == [str(layout.id), str(layout.version)]:
+            return
+    raise HTTPException(412, "Layout was modified since it was fetched.")
+
 @router.post("/dashboard-layout")
 def save_dashboard_layout(
     layout: DashboardLayoutModel,
@@ -20,45 +150,94 @@ def save_dashboard_layout(
         .filter_by(user_id=user.id, layout_name=layout.layout_name)
         .first()
     )
-    # Just pass through the data, don't dict() if already dicts!
-    layout_json = json.dumps([
-        item.dict() if hasattr(item, "dict") else item
-        for item in layout.layout_data
-    ])
+    layout_json = _dump_layout_data(layout.layout_data)
+    sent_comments = _sent_comments(layout.layout_data)
     
     if existing:
-        existing.layout_data = layout_json
+        existing.layout_json = layout_json
         existing.description = layout.description
     else:
         existing = UserDashboardLayout(
             user_id=user.id,
             layout_name=layout.layout_name,
             description=layout.description,
-            layout_data=layout_json,
         )
+        existing.layout_json = layout_json
         db.add(existing)
+        db.flush()
+    _replace_comments(db, existing.id, sent_comments)
     db.commit()
-    return {
+    return _layout_response({
         "msg": f"Layout '{layout.layout_name}' saved.",
         "id": existing.id,
         "user_id": existing.user_id,
         "layout_name": existing.layout_name,
         "description": existing.description,
         "created_at": existing.created_at,
-        "layout_data": json.loads(existing.layout_data),
-    }
+    }, layout_json)
     
+def _encode_cursor(row):
+    raw = json.dumps([bool(row.is_favorite), row.created_at.isoformat() if row.created_at else None, row.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        is_favorite, created_at, layout_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return bool(is_favorite), datetime.fromisoformat(created_at) if created_at else None, int(layout_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor.")
+
 @router.get("/dashboard-layouts")
-def get_dashboard_layouts(
-    db: Session = Depends(get_db),
+async def get_dashboard_layouts(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db = Depends(get_read_db),
     user = Depends(get_current_user),
 ):
-    layouts = (
-        db.query(UserDashboardLayout)
-        .filter_by(user_id=user.id)
-        .order_by(UserDashboardLayout.is_favorite.desc(), UserDashboardLayout.created_at.desc())
-        .all()
+    # Cheap aggregate first: any insert, update or delete changes it
+    L = UserDashboardLayout
+    count, max_updated_at, version_sum = (await db.execute(
+        select(func.count(L.id), func.max(L.updated_at), func.sum(L.version))
+        .where(L.user_id == user.id)
+    )).one()
+    stamp = f"{user.id}|{count}|{max_updated_at}|{version_sum}|{limit}|{cursor}"
+    etag = '"' + hashlib.sha1(stamp.encode()).hexdigest()[:24] + '"'
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    # Project only the listing columns (never layout_data) and join the
+    # creator's name in the same query instead of lazy-loading l.user per row.
+    query = (
+        select(
+            L.id, L.layout_name, L.description, L.created_at,
+            L.user_id, L.is_favorite, User.first_name, User.last_name,
+        )
+        .outerjoin(User, User.id == L.user_id)
+        .where(L.user_id == user.id)
+        .order_by(L.is_favorite.desc(), L.created_at.desc(), L.id.desc())
     )
+    if cursor:
+        # Keyset: rows strictly after the cursor in (is_favorite, created_at, id) DESC order
+        is_favorite, created_at, layout_id = _decode_cursor(cursor)
+        same_favorite = L.is_favorite == is_favorite
+        after = [
+            and_(same_favorite, L.created_at < created_at),
+            and_(same_favorite, L.created_at == created_at, L.id < layout_id),
+        ]
+        if is_favorite:
+            after.append(L.is_favorite == False)  # noqa: E712
+        query = query.where(or_(*after))
+    if limit:
+        rows = (await db.execute(query.limit(limit + 1))).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
+    else:
+        rows = (await db.execute(query)).all()
     return [
         {
             "id": l.id,
@@ -67,12 +246,12 @@ def get_dashboard_layouts(
             "created_at": l.created_at,
             "user_id": l.user_id,
             "created_by": (
-                f"{(getattr(l.user, 'first_name', '') or '').title()} {(getattr(l.user, 'last_name', '') or '').title()}".strip()
-                if l.user else None
+                f"{(l.first_name or '').title()} {(l.last_name or '').title()}".strip()
+                if l.first_name is not None or l.last_name is not None else None
             ),
             "is_favorite": l.is_favorite,
         }
-        for l in layouts
+        for l in rows
     ]
 
 @router.post("/dashboard-layouts/{layout_id}/favorite")
@@ -96,27 +275,42 @@ def set_favorite(
 
 
 @router.get("/dashboard-layout/{layout_id}")
-def get_dashboard_layout(
+async def get_dashboard_layout(
     layout_id: int,
-    db: Session = Depends(get_db),
+    include_comments: bool = Query(True),
+    if_none_match: Optional[str] = Header(None),
+    db = Depends(get_read_db),
     user = Depends(get_current_user),
 ):
-    layout = (
-        db.query(UserDashboardLayout)
-        .filter_by(user_id=user.id, id=layout_id)
-        .first()
-    )
+    L = UserDashboardLayout
+    owned = and_(L.user_id == user.id, L.id == layout_id)
+    # Version-only query so unchanged layouts are answered without loading layout_data
+    version = (await db.execute(select(L.version).where(owned))).scalar()
+    if version is None:
+        raise HTTPException(404, "Layout not found.")
+    comment_state = await _comment_state(db, layout_id) if include_comments else None
+    etag = layout_etag(layout_id, version, comment_state)
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+
+    layout = (await db.execute(select(L).where(owned))).scalar()
     if not layout:
         raise HTTPException(404, "Layout not found.")
-    return {
+    # Stored text is passed through untouched unless there are comments to merge
+    layout_json = layout.layout_json
+    if comment_state and comment_state[0]:
+        layout_json = json.dumps(await _merge_comments(db, layout.id, json.loads(layout_json)))
+    return _layout_response({
         "id": layout.id,
         "layout_name": layout.layout_name,
         "description": layout.description,  # add description
-        "layout_data": json.loads(layout.layout_data),
         "created_at": layout.created_at,
         "user_id": layout.user_id,
         "created_by": getattr(layout, "created_by", None),  # if you have it
-    }
+    }, layout_json, headers={
+        "ETag": layout_etag(layout.id, layout.version, comment_state),
+        "Cache-Control": "private, no-cache",
+    })
     
     
 @router.delete("/dashboard-layout/{layout_id}")
@@ -132,6 +326,7 @@ def delete_dashboard_layout(
     )
     if not existing:
         raise HTTPException(404, "Layout not found.")
+    db.query(LayoutReportComment).filter_by(layout_id=layout_id).delete(synchronize_session=False)
     db.delete(existing)
     db.commit()
     return {"msg": f"Layout deleted.", "id": layout_id, "user_id": user.id}
@@ -152,26 +347,35 @@ def update_dashboard_layout(
     if not existing:
         raise HTTPException(404, "Layout not found.")
 
-    # layout_data is a list of dicts from Pydantic, so dump as JSON
-    layout_data_dicts = [item.dict() for item in layout.layout_data]
-    layout_json = json.dumps(layout_data_dicts)
+    layout_json = _dump_layout_data(layout.layout_data)
+    sent_comments = _sent_comments(layout.layout_data)
 
     existing.layout_name = layout.layout_name
     existing.description = layout.description
-    existing.layout_data = layout_json
+    existing.layout_json = layout_json
+
+    # Keep comments of reports still on the layout unless new ones were sent
+    report_ids = [item.report_id for item in layout.layout_data]
+    (
+        db.query(LayoutReportComment)
+        .filter(
+            LayoutReportComment.layout_id == layout_id,
+            LayoutReportComment.report_id.notin_(report_ids),
+        )
+        .delete(synchronize_session=False)
+    )
+    _replace_comments(db, layout_id, sent_comments)
 
     db.commit()
-    db.refresh(existing)
 
-    return {
+    return _layout_response({
         "msg": f"Layout '{existing.layout_name}' updated.",
         "id": existing.id,
         "user_id": existing.user_id,
         "layout_name": existing.layout_name,
         "description": existing.description,
         "created_at": existing.created_at,
-        "layout_data": json.loads(existing.layout_data),
-    }
+    }, layout_json, headers={"ETag": layout_etag(existing.id, existing.version)})
     
 @router.put("/dashboard-layout/{layout_id}/report-comments")
 def update_report_comments(
@@ -180,27 +384,175 @@ def update_report_comments(
     db: Session = Depends(get_db),
     user = Depends(get_current_user)
 ):
-    layout = (
+    _require_layout_report(db, user, layout_id, payload.report_id)
+    _replace_comments(
+        db, layout_id, {payload.report_id: [comment.model_dump() for comment in payload.comments]}
+    )
+    db.commit()
+    return {"msg": "Comments updated.", "layout_id": layout_id, "report_id": payload.report_id}
+
+
+def _validate_patched_layout(doc, touched):
+    if set(doc) != {"layout_name", "description", "layout_data"}:
+        raise HTTPException(422, "Only layout_name, description and layout_data can be patched.")
+    if not isinstance(doc["layout_name"], str) or not doc["layout_name"]:
+        raise HTTPException(422, "layout_name must be a non-empty string.")
+    if doc["description"] is not None and not isinstance(doc["description"], str):
+        raise HTTPException(422, "description must be a string or null.")
+    if not isinstance(doc["layout_data"], list):
+        raise HTTPException(422, "layout_data must be a list.")
+    # Only items an operation touched are revalidated
+    sent_comments = {}
+    for i, item in enumerate(doc["layout_data"]):
+        if id(item) not in touched:
+            continue
+        try:
+            model = LayoutReportModel.model_validate(item)
+        except ValidationError as e:
+            raise HTTPException(422, {"item": i, "errors": e.errors(include_url=False, include_context=False)})
+        sent_comments.update(_sent_comments([model]))
+        doc["layout_data"][i] = model.model_dump(exclude={"comments"})
+    return sent_comments
+
+@router.patch("/dashboard-layout/{layout_id}")
+def patch_dashboard_layout(
+    layout_id: int,
+    operations: List[PatchOperation] = Body(...),
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    existing = (
         db.query(UserDashboardLayout)
         .filter_by(user_id=user.id, id=layout_id)
         .first()
     )
-    if not layout:
+    if not existing:
         raise HTTPException(404, "Layout not found.")
+    _check_if_match(if_match, existing)
 
-    layout_data = json.loads(layout.layout_data)
-    found = False
+    doc = {
+        "layout_name": existing.layout_name,
+        "description": existing.description,
+        "layout_data": json.loads(existing.layout_json or "[]"),
+    }
+    old_report_ids = {item.get("report_id") for item in doc["layout_data"]}
+    touched = set()
+    try:
+        for operation in operations:
+            op = operation.model_dump(by_alias=True, exclude_unset=True)
+            apply_operation(doc, op)
+            # Remember which layout_data item this operation wrote to
+            tokens = parse_pointer(op["path"])
+            items = doc["layout_data"]
+            if op["op"] not in ("add", "replace", "move", "copy") or tokens[:1] != ["layout_data"]:
+                continue
+            if not isinstance(items, list):
+                # Rejected by _validate_patched_layout below
+                continue
+            if len(tokens) == 1:
+                touched.update(id(item) for item in items)
+            else:
+                index = len(items) - 1 if tokens[1] == "-" else _index(items, tokens[1], allow_end=False)
+                touched.add(id(items[index]))
+    except JsonPatchTestFailed as e:
+        raise HTTPException(409, str(e))
+    except (JsonPatchError, TypeError) as e:
+        raise HTTPException(422, str(e))
+    sent_comments = _validate_patched_layout(doc, touched)
 
-    for report in layout_data:
-        if report.get("report_id") == payload.report_id:
-            report["comments"] = [comment.dict() for comment in payload.comments]
-            found = True
-            break
+    existing.layout_name = doc["layout_name"]
+    existing.description = doc["description"]
+    existing.layout_json = json.dumps(doc["layout_data"])
 
-    if not found:
-        raise HTTPException(404, "Report not found in layout.")
+    new_report_ids = {item.get("report_id") for item in doc["layout_data"]}
+    removed = old_report_ids - new_report_ids
+    if removed:
+        (
+            db.query(LayoutReportComment)
+            .filter(
+                LayoutReportComment.layout_id == layout_id,
+                LayoutReportComment.report_id.in_(list(removed)),
+            )
+            .delete(synchronize_session=False)
+        )
+    _replace_comments(db, layout_id, sent_comments)
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(409, "Layout was modified concurrently, refetch and retry.")
+
+    return Response(
+        content=json.dumps({
+            "msg": f"Layout '{existing.layout_name}' patched.",
+            "id": existing.id,
+            "version": existing.version,
+        }),
+        media_type="application/json",
+        headers={"ETag": layout_etag(existing.id, existing.version)},
+    )
 
-    layout.layout_data = json.dumps(layout_data)
+
+@router.get("/dashboard-layout/{layout_id}/reports/{report_id}/comments")
+def get_report_comments(
+    layout_id: int,
+    report_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = None,
+    db: Session = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    if not _owned_layout_exists(db, user, layout_id):
+        raise HTTPException(404, "Layout not found.")
+    query = (
+        db.query(LayoutReportComment)
+        .filter_by(layout_id=layout_id, report_id=report_id)
+        .order_by(LayoutReportComment.id)
+    )
+    if cursor is not None:
+        query = query.filter(LayoutReportComment.id > cursor)
+    comments = query.limit(limit + 1).all()
+    next_cursor = comments[limit - 1].id if len(comments) > limit else None
+    return {
+        "layout_id": layout_id,
+        "report_id": report_id,
+        "comments": [_comment_dict(c) for c in comments[:limit]],
+        "next_cursor": next_cursor,
+    }
+
+
+@router.post("/dashboard-layout/{layout_id}/reports/{report_id}/comments")
+def add_report_comment(
+    layout_id: int,
+    report_id: str,
+    payload: ReportComment,
+    db: Session = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    _require_layout_report(db, user, layout_id, report_id)
+    comment = LayoutReportComment(layout_id=layout_id, report_id=report_id, **payload.model_dump())
+    db.add(comment)
     db.commit()
-    db.refresh(layout)
-    return {"msg": "Comments updated.", "layout_id": layout_id, "report_id": payload.report_id}
\ No newline at end of file
+    return _comment_dict(comment)
+
+
+@router.delete("/dashboard-layout/{layout_id}/reports/{report_id}/comments/{comment_id}")
+def delete_report_comment(
+    layout_id: int,
+    report_id: str,
+    comment_id: int,
+    db: Session = Depends(get_db),
+    user = Depends(get_current_user),
+):
+    if not _owned_layout_exists(db, user, layout_id):
+        raise HTTPException(404, "Layout not found.")
+    deleted = (
+        db.query(LayoutReportComment)
+        .filter_by(id=comment_id, layout_id=layout_id, report_id=report_id)
+        .delete(synchronize_session=False)
+    )
+    if not deleted:
+        raise HTTPException(404, "Comment not found.")
+    db.commit()
+    return {"msg": "Comment deleted.", "id": comment_id, "layout_id": layout_id, "report_id": report_id}
\ No newline at end of file
@@ -1,27 +1,164 @@
 # main.py
-from fastapi import FastAPI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import secrets
+import anyio.to_thread
+from fastapi import FastAPI, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from database import Base, engine
+from database import dispose_engines, get_engine, init_engines, ping, pool_stats
 import models
+import migrations
 from auth import router as auth_router
 from layouts import router as layouts_router
 from user import router as user_router
 from reports import router as reports_router
 from embed import router as embed_router
+from layout_transfer import router as layout_transfer_router
+from auth import get_current_user, require_admin
+from cache import all_cache_stats
+import metrics
+import powerbi_client
+import passwords
+import embed_renewal
+from fetch_scheduler import scheduler as fetch_scheduler
+import profiling
+from app_logging import RequestIdMiddleware, setup_logging, shutdown_logging
+from powerbi_utils import get_fernet
 
-Base.metadata.create_all(bind=engine)
+# When set, GET /metrics requires "Authorization: Bearer <METRICS_TOKEN>";
+# otherwise it requires an admin's access token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Schema changes run with "python manage.py migrate"; this is for local dev only
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "2"))
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup builds objects only; nothing waits on the database, /readyz
+    # reports whether it can be reached.
+    setup_logging()
+    init_engines()
+    get_fernet()
+    # One pooled keep-alive client to Power BI/AAD per worker
+    await powerbi_client.start()
+    embed_renewal.scheduler.start()
+    if AUTO_MIGRATE:
+        await run_in_threadpool(migrations.migrate, get_engine())
+    yield
+    await embed_renewal.scheduler.stop()
+    await powerbi_client.close()
+    passwords.shutdown()
+    await dispose_engines()
+    shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # For dev, "*" is fine. For prod, list your frontend URL(s)
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Request-ID", "X-Profile-Id"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiling.ProfilerMiddleware)
+# Outermost, so everything below logs under the request id
+app.add_middleware(RequestIdMiddleware)
 
 app.include_router(auth_router)
 app.include_router(layouts_router)
+app.include_router(layout_transfer_router)
 app.include_router(user_router)
 app.include_router(reports_router)
 app.include_router(embed_router)
+app.include_router(profiling.router)
+
+
+@app.get("/cache/stats")
+def cache_stats(user = Depends(require_admin)):
+    return all_cache_stats()
+
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    try:
+        await asyncio.wait_for(run_in_threadpool(ping), READINESS_TIMEOUT)
+    except asyncio.TimeoutError:
+        return JSONResponse({"status": "unavailable", "database": "timeout"}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"status": "unavailable", "database": type(e).__name__}, status_code=503)
+    return {"status": "ok", "database": "ok"}
+
+
+@app.get("/db/stats")
+def db_stats(user = Depends(require_admin)):
+    return pool_stats()
+
+
+@metrics.register_collector
+def _runtime_metrics():
+    pools = pool_stats()
+    caches = all_cache_stats()
+    # Sync routes and dependencies run on anyio's default thread limiter
+    limiter = anyio.to_thread.current_default_thread_limiter().statistics()
+    renewals = embed_renewal.scheduler.stats()
+    tenants = fetch_scheduler.stats()
+    return [
+        ("db_pool_checked_out", "gauge", "Connections checked out of the pool.",
+         [({"engine": n}, s.get("checked_out", 0)) for n, s in pools.items()]),
+        ("db_pool_utilization", "gauge", "Checked-out share of pool_size + max_overflow.",
+         [({"engine": n}, s.get("utilization", 0.0)) for n, s in pools.items()]),
+        ("db_pool_checkout_wait_seconds_total", "counter", "Time spent waiting for a pooled connection.",
+         [({"engine": n}, s["wait_seconds_total"]) for n, s in pools.items()]),
+        ("db_pool_checkout_timeouts_total", "counter", "Checkouts that timed out waiting.",
+         [({"engine": n}, s["timeouts"]) for n, s in pools.items()]),
+        ("threadpool_busy_threads", "gauge", "Worker threads running sync handlers.",
+         [({}, limiter.borrowed_tokens)]),
+        ("threadpool_size", "gauge", "Worker thread limit.", [({}, limiter.total_tokens)]),
+        ("threadpool_queue_depth", "gauge", "Calls waiting for a worker thread.",
+         [({}, limiter.tasks_waiting)]),
+        ("password_hash_queue_depth", "gauge", "Bcrypt jobs queued or running.",
+         [({}, passwords.queue_depth())]),
+        ("embed_stream_sessions", "gauge", "Layouts with open embed streams.", [({}, renewals["sessions"])]),
+        ("embed_stream_subscribers", "gauge", "Open embed streams.", [({}, renewals["subscribers"])]),
+        ("embed_token_renewals_total", "counter", "generateToken calls made by the renewal scheduler.",
+         [({}, renewals["renewals"])]),
+        ("embed_token_renewal_failures_total", "counter", "Failed renewal batches.", [({}, renewals["failures"])]),
+        ("reports_fetch_concurrency_limit", "gauge", "Adaptive workspace fetch limit per tenant.",
+         [({"tenant": t}, s["limit"]) for t, s in tenants.items()]),
+        ("reports_fetch_in_flight", "gauge", "Workspace fetches holding a slot per tenant.",
+         [({"tenant": t}, s["in_flight"]) for t, s in tenants.items()]),
+        ("reports_fetch_throttled_total", "counter", "429/503 responses seen by the fetch scheduler.",
+         [({"tenant": t}, s["throttled"]) for t, s in tenants.items()]),
+        ("cache_entries", "gauge", "Entries held per cache.",
+         [({"cache": n}, s["size"]) for n, s in caches.items()]),
+        ("cache_hits_total", "counter", "Cache hits.", [({"cache": n}, s["hits"]) for n, s in caches.items()]),
+        ("cache_misses_total", "counter", "Cache misses.", [({"cache": n}, s["misses"]) for n, s in caches.items()]),
+        ("cache_evictions_total", "counter", "Expired or LRU-evicted entries.",
+         [({"cache": n}, s["evictions"]) for n, s in caches.items()]),
+    ]
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(authorization: str = Header(None)):
+    if METRICS_TOKEN:
+        if not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(401, "Invalid metrics token.")
+    else:
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(401, "Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        require_admin(get_current_user(token))
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
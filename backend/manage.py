@@ -0,0 +1,41 @@
+# manage.py
+# Deploy-time database tasks, kept out of app startup:
+#
+#   python manage.py migrate            create missing tables, columns, indexes
+#   python manage.py compress-layouts   compress stored layouts (LAYOUT_COMPRESSION)
+import argparse
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_engines
+import migrations
+
+
+def migrate(args):
+    start = time.perf_counter()
+    migrations.migrate(init_engines())
+    print(f"Schema up to date ({time.perf_counter() - start:.2f}s).")
+
+def compress_layouts(args):
+    import layout_storage
+    if not layout_storage.COMPRESS_LAYOUTS:
+        print("LAYOUT_COMPRESSION is off, nothing to do.")
+        return
+    count = migrations.compress_layouts(init_engines(), batch_size=args.batch_size)
+    print(f"Compressed {count} layouts.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backend management commands.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="create and upgrade the schema").set_defaults(run=migrate)
+    compress = commands.add_parser("compress-layouts", help="compress stored layout_data")
+    compress.add_argument("--batch-size", type=int, default=100)
+    compress.set_defaults(run=compress_layouts)
+    args = parser.parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
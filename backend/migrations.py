@@ -0,0 +1,109 @@
+# migrations.py
+import json
+from sqlalchemy import func, inspect, insert, select, text, update
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.orm import Session
+from database import Base
+from models import UserDashboardLayout, LayoutReportComment
+import layout_storage
+
+COMMENT_FIELDS = ("text", "author", "author_id", "date")
+
+def migrate(engine):
+    Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+
+# create_all() only creates missing tables. This brings tables that already
+# exist up to date with columns and indexes added to the models afterwards.
+# New columns must be nullable or carry a server_default.
+def upgrade(engine):
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name, schema=table.schema):
+            continue
+        columns = {col["name"] for col in inspector.get_columns(table.name, schema=table.schema)}
+        for column in table.columns:
+            if column.name not in columns:
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD {ddl}"))
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name, schema=table.schema)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+    move_inline_comments(engine)
+
+def move_inline_comments(engine, batch_size=100):
+    # Layouts saved before comments had their own table kept them inside
+    # layout_data; move them out once. Matches only non-empty lists, walked
+    # in keyset batches by id with one commit per batch. "[" is escaped
+    # since SQL Server's LIKE reads it as a character class.
+    last_id = 0
+    while True:
+        with Session(engine) as db:
+            layouts = (
+                db.query(UserDashboardLayout)
+                .filter(
+                    UserDashboardLayout.id > last_id,
+                    UserDashboardLayout.layout_data.like('%"comments": \\[{%', escape="\\"),
+                )
+                .order_by(UserDashboardLayout.id)
+                .limit(batch_size)
+                .all()
+            )
+            if layouts:
+                last_id = layouts[-1].id
+            for layout in layouts:
+                items = json.loads(layout.layout_data)
+                rows = []
+                for item in items:
+                    for c in item.pop("comments", None) or []:
+                        rows.append({
+                            "layout_id": layout.id,
+                            "report_id": item.get("report_id"),
+                            **{f: c.get(f) for f in COMMENT_FIELDS},
+                        })
+                if rows:
+                    db.execute(insert(LayoutReportComment), rows)
+                layout.layout_json = json.dumps(items)
+            db.commit()
+        if len(layouts) < batch_size:
+            return
+
+def compress_layouts(engine, batch_size=100):
+    # Compresses plain-text layouts over the size threshold, one committed
+    # batch at a time, so it can be stopped and resumed at any point. Rows
+    # written meanwhile are skipped by the version check and compressed on
+    # write instead; version and updated_at are left as they were since the
+    # content doesn't change.
+    if not layout_storage.COMPRESS_LAYOUTS:
+        return 0
+    L = UserDashboardLayout.__table__
+    compressed, last_id = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(L.c.id, L.c.version, L.c.updated_at, L.c.layout_data)
+                .where(
+                    L.c.id > last_id,
+                    L.c.layout_data_z.is_(None),
+                    func.length(L.c.layout_data) >= layout_storage.COMPRESS_MIN_BYTES,
+                )
+                .order_by(L.c.id)
+                .limit(batch_size)
+            ).all()
+            for row in rows:
+                result = conn.execute(
+                    update(L)
+                    .where(L.c.id == row.id, L.c.version == row.version)
+                    .values(
+                        layout_data=None,
+                        layout_data_z=layout_storage.compress(row.layout_data),
+                        updated_at=row.updated_at,
+                    )
+                )
+                compressed += result.rowcount
+        if len(rows) < batch_size:
+            return compressed
+        last_id = rows[-1].id
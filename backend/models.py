@@ -1,7 +1,8 @@
 # models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, Text, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, Text, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
+import layout_storage
 import os
 
 SQL_SCHEMA = os.getenv("SQL_SCHEMA", "dbo")
@@ -29,13 +30,46 @@ class UserCredential(Base):
 
 class UserDashboardLayout(Base):
     __tablename__ = "user_dashboard_layouts"
-    __table_args__ = {"schema": SQL_SCHEMA}
+    __table_args__ = (
+        # Covers the keyset-paginated listing order in layouts.get_dashboard_layouts
+        Index("ix_user_dashboard_layouts_listing", "user_id", "is_favorite", "created_at", "id"),
+        {"schema": SQL_SCHEMA},
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey(f"{SQL_SCHEMA}.users.id"))
     layout_name = Column(String(255))
     description = Column(Text, nullable=True)
     layout_data = Column(Text)
+    # Compressed layout JSON (see layout_storage); read and write via layout_json
+    layout_data_z = Column(LargeBinary, nullable=True)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     is_favorite = Column(Boolean, default=False)
-    user = relationship("User", backref="dashboard_layouts")
\ No newline at end of file
+    # Bumped by SQLAlchemy on every UPDATE; stale writers get a StaleDataError
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    user = relationship("User", backref="dashboard_layouts")
+    __mapper_args__ = {"version_id_col": version}
+
+    @property
+    def layout_json(self):
+        return layout_storage.decode(self.layout_data, self.layout_data_z)
+
+    @layout_json.setter
+    def layout_json(self, text):
+        self.layout_data, self.layout_data_z = layout_storage.encode(text)
+
+
+class LayoutReportComment(Base):
+    __tablename__ = "layout_report_comments"
+    __table_args__ = (
+        Index("ix_layout_report_comments_layout_report", "layout_id", "report_id", "id"),
+        {"schema": SQL_SCHEMA},
+    )
+    id = Column(Integer, primary_key=True)
+    layout_id = Column(Integer, ForeignKey(f"{SQL_SCHEMA}.user_dashboard_layouts.id"), nullable=False)
+    report_id = Column(String(255), nullable=False)
+    text = Column(Text)
+    author = Column(String(255))
+    author_id = Column(String(255), nullable=True)
+    date = Column(String(64), nullable=True)  # client-supplied, stored as sent
+    created_at = Column(DateTime, default=func.now())
@@ -0,0 +1,102 @@
+# powerbi_client.py
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import httpx
+from metrics import upstream_request_duration
+
+# Overridable to point at a stand-in such as bench/powerbi_stub.py
+API_BASE = os.getenv("POWERBI_API_BASE", "https://api.powerbi.com/v1.0/myorg").rstrip("/")
+AUTHORITY_HOST = os.getenv("POWERBI_AUTHORITY_HOST", "https://login.microsoftonline.com").rstrip("/")
+
+POOL_MAX_CONNECTIONS = int(os.getenv("POWERBI_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE = int(os.getenv("POWERBI_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("POWERBI_POOL_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("POWERBI_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("POWERBI_READ_TIMEOUT", "20"))
+POOL_TIMEOUT = float(os.getenv("POWERBI_POOL_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("POWERBI_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("POWERBI_RETRY_BACKOFF", "0.5"))
+MAX_RETRY_WAIT = float(os.getenv("POWERBI_MAX_RETRY_WAIT", "30"))
+VERIFY_TLS = os.getenv("POWERBI_VERIFY_TLS", "false").lower() == "true"
+
+RETRY_STATUSES = (429, 503)
+
+_client = None
+
+def create_client():
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT
+        ),
+        verify=VERIFY_TLS,
+    )
+
+async def start():
+    global _client
+    if _client is None:
+        _client = create_client()
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_client():
+    # Normally created by the app lifespan; scripts get one lazily.
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+def _retry_delay(resp, attempt):
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after)
+                delay = (when - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = RETRY_BACKOFF * 2 ** attempt
+    else:
+        delay = RETRY_BACKOFF * 2 ** attempt + random.uniform(0, RETRY_BACKOFF)
+    return min(max(delay, 0), MAX_RETRY_WAIT)
+
+async def request(method, url, operation="other", on_attempt=None, **kwargs):
+    # operation labels the upstream latency metric, e.g. "generate_token";
+    # on_attempt(status, seconds) is called for every response, retried or not
+    client = get_client()
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+        except httpx.TimeoutException:
+            upstream_request_duration.observe(time.perf_counter() - start, operation=operation, status="timeout")
+            raise
+        except (httpx.HTTPError, asyncio.CancelledError):
+            upstream_request_duration.observe(time.perf_counter() - start, operation=operation, status="error")
+            raise
+        elapsed = time.perf_counter() - start
+        upstream_request_duration.observe(elapsed, operation=operation, status=resp.status_code)
+        if on_attempt is not None:
+            on_attempt(resp.status_code, elapsed)
+        if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return resp
+        await asyncio.sleep(_retry_delay(resp, attempt))
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
@@ -1,25 +1,79 @@
 import os
+import hashlib
+import threading
+from datetime import datetime, timezone
 from cryptography.fernet import Fernet
-import requests
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from models import UserCredential
+from cache import TTLCache, SingleFlight
+import powerbi_client
 
-FERNET_KEY = os.getenv("FERNET_KEY")
-if not FERNET_KEY:
-    raise RuntimeError("FERNET_KEY environment variable is not set.")
-fernet = Fernet(FERNET_KEY.encode())
+_fernet = None
+_fernet_lock = threading.Lock()
+
+def get_fernet():
+    # Built on first use (or by the app lifespan), not at import
+    global _fernet
+    with _fernet_lock:
+        if _fernet is None:
+            key = os.getenv("FERNET_KEY")
+            if not key:
+                raise RuntimeError("FERNET_KEY environment variable is not set.")
+            _fernet = Fernet(key.encode())
+        return _fernet
+
+# Refresh AAD tokens this many seconds before Azure says they expire.
+TOKEN_EXPIRY_MARGIN = int(os.getenv("POWERBI_TOKEN_EXPIRY_MARGIN", "300"))
+TOKEN_CACHE_SIZE = int(os.getenv("POWERBI_TOKEN_CACHE_SIZE", "512"))
+# Embed tokens are reused until this many seconds before their expiration.
+EMBED_TOKEN_EXPIRY_MARGIN = int(os.getenv("POWERBI_EMBED_TOKEN_EXPIRY_MARGIN", "120"))
+EMBED_TOKEN_CACHE_SIZE = int(os.getenv("POWERBI_EMBED_TOKEN_CACHE_SIZE", "2048"))
+CREDENTIAL_CACHE_TTL = int(os.getenv("POWERBI_CREDENTIAL_CACHE_TTL", "300"))
+CREDENTIAL_CACHE_SIZE = int(os.getenv("POWERBI_CREDENTIAL_CACHE_SIZE", "10000"))
+# Report metadata (embedUrl, datasetId, name) barely changes. Misses are only
+# remembered briefly and per credential, since another service principal may
+# well be able to see the report.
+REPORT_INFO_TTL = int(os.getenv("POWERBI_REPORT_INFO_TTL", "86400"))
+REPORT_INFO_NEGATIVE_TTL = int(os.getenv("POWERBI_REPORT_INFO_NEGATIVE_TTL", "60"))
+REPORT_INFO_CACHE_SIZE = int(os.getenv("POWERBI_REPORT_INFO_CACHE_SIZE", "20000"))
+REPORT_INFO_FIELDS = ("id", "name", "embedUrl", "datasetId")
+REPORT_NOT_FOUND = object()
+
+_token_cache = TTLCache("aad_tokens", maxsize=TOKEN_CACHE_SIZE, ttl=3600)
+_token_flight = SingleFlight()
+_embed_token_cache = TTLCache("embed_tokens", maxsize=EMBED_TOKEN_CACHE_SIZE, ttl=3600)
+# user_id -> decrypted (client_id, tenant_id, secret)
+_credential_cache = TTLCache("user_credentials", maxsize=CREDENTIAL_CACHE_SIZE, ttl=CREDENTIAL_CACHE_TTL)
+# (group_id, report_id) -> report fields
+_report_info_cache = TTLCache("report_info", maxsize=REPORT_INFO_CACHE_SIZE, ttl=REPORT_INFO_TTL)
+# (cred_key, group_id, report_id) -> REPORT_NOT_FOUND; kept apart so its
+# lookups don't count as report_info misses
+_report_not_found_cache = TTLCache("report_not_found", maxsize=REPORT_INFO_CACHE_SIZE, ttl=REPORT_INFO_NEGATIVE_TTL)
+report_info_flight = SingleFlight()
 
 def get_powerbi_credentials(db: Session, user):
+    cached = _credential_cache.get(user.id)
+    if cached is not None:
+        return cached
     cred = db.query(UserCredential).filter_by(user_id=user.id).first()
     if not cred:
         raise HTTPException(400, "No Power BI credentials set for user.")
     client_id, tenant_id = cred.client_id, cred.tenant_id
-    secret = fernet.decrypt(cred.secret_enc.encode()).decode()
+    secret = get_fernet().decrypt(cred.secret_enc.encode()).decode()
+    _credential_cache.set(user.id, (client_id, tenant_id, secret))
     return client_id, tenant_id, secret
 
-def get_access_token(client_id, tenant_id, secret):
-    authority = f"https://login.microsoftonline.com/{tenant_id}"
+def invalidate_user_credentials(user_id):
+    _credential_cache.pop(user_id)
+
+def credential_key(client_id, tenant_id, secret):
+    # Never keep the raw secret in a cache key, only its fingerprint.
+    fingerprint = hashlib.sha256(secret.encode()).hexdigest()
+    return (tenant_id, client_id, fingerprint)
+
+async def _request_access_token(client_id, tenant_id, secret):
+    authority = f"{powerbi_client.AUTHORITY_HOST}/{tenant_id}"
     token_url = f"{authority}/oauth2/v2.0/token"
     data = {
         "grant_type": "client_credentials",
@@ -27,7 +81,68 @@ def get_access_token(client_id, tenant_id, secret):
         "client_secret": secret,
         "scope": "https://analysis.windows.net/powerbi/api/.default",
     }
-    resp = requests.post(token_url, data=data, verify=False, timeout=10)
-    if not resp.ok:
+    resp = await powerbi_client.post(token_url, data=data, timeout=10, operation="aad_token")
+    if not resp.is_success:
         raise HTTPException(400, f"Failed to get Power BI token: {resp.text}")
-    return resp.json()["access_token"]
+    return resp.json()
+
+async def get_access_token(client_id, tenant_id, secret):
+    key = credential_key(client_id, tenant_id, secret)
+    token = _token_cache.get(key)
+    if token is not None:
+        return token
+
+    async def refresh():
+        # Another caller may have refreshed while we waited to become leader.
+        cached = _token_cache.peek(key)
+        if cached is not None:
+            return cached
+        body = await _request_access_token(client_id, tenant_id, secret)
+        expires_in = int(body.get("expires_in", 3600))
+        ttl = expires_in - TOKEN_EXPIRY_MARGIN
+        if ttl <= 0:
+            ttl = expires_in / 2
+        _token_cache.set(key, body["access_token"], ttl=ttl)
+        return body["access_token"]
+
+    return await _token_flight.do(key, refresh)
+
+def _seconds_until(expiration):
+    try:
+        expires_at = datetime.fromisoformat(expiration.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return 0
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return (expires_at - datetime.now(timezone.utc)).total_seconds()
+
+def get_cached_embed_token(cred_key, group_id, report_id, dataset_id, access_level="View"):
+    return _embed_token_cache.get((cred_key, group_id, report_id, dataset_id, access_level))
+
+def cache_embed_token(cred_key, group_id, report_id, dataset_id, token_body, access_level="View"):
+    ttl = _seconds_until(token_body.get("expiration")) - EMBED_TOKEN_EXPIRY_MARGIN
+    if ttl > 0:
+        _embed_token_cache.set((cred_key, group_id, report_id, dataset_id, access_level), token_body, ttl=ttl)
+
+def get_cached_report_info(group_id, report_id, cred_key=None):
+    info = _report_info_cache.get((group_id, report_id))
+    if info is None and cred_key is not None:
+        info = _report_not_found_cache.get((cred_key, group_id, report_id))
+    return info
+
+def cache_report_info(group_id, report_id, report):
+    # Accepts both GET report and workspace listing entries
+    _report_info_cache.set((group_id, report_id), {f: report.get(f) for f in REPORT_INFO_FIELDS})
+
+def cache_report_not_found(cred_key, group_id, report_id):
+    _report_not_found_cache.set((cred_key, group_id, report_id), REPORT_NOT_FOUND)
+
+def invalidate_credentials(client_id, tenant_id, secret):
+    key = credential_key(client_id, tenant_id, secret)
+    _token_cache.pop(key)
+    _embed_token_cache.discard_where(lambda k: k[0] == key)
+
+def invalidate_all_credentials():
+    # For when the old secret can't be decrypted and its fingerprint is unknown
+    _token_cache.clear()
+    _embed_token_cache.clear()
@@ -0,0 +1,130 @@
+# profiling.py
+# On-demand cProfile capture of a single request. Admins send "X-Profile: 1";
+# the response carries X-Profile-Id and the profile is read back from
+# GET /admin/profiles/{profile_id}.
+#
+# The profiler follows the event loop thread, so the sync handlers FastAPI
+# runs in its threadpool show up as time spent awaiting them, and other
+# requests running on the loop at the same time are included.
+import cProfile
+import io
+import os
+import pstats
+import re
+import tempfile
+import threading
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
+from app_logging import request_id_var
+from auth import is_admin_username, require_admin
+from tokens import TokenError, decode_token
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "backend-profiles"))
+# Newest profiles kept on disk
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+_PROFILE_ID = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._-]{0,63}$")
+# Only one profiler can be active in the process at a time
+_active = threading.Lock()
+
+router = APIRouter()
+
+
+def _admin_token(scope):
+    auth = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        claims = decode_token(token, "access")
+    except TokenError:
+        return False
+    return is_admin_username(claims.get("username"))
+
+def _profile_path(profile_id):
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+def _save(profile, profile_id):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile.dump_stats(_profile_path(profile_id))
+    files = sorted(
+        (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith(".prof")),
+        key=os.path.getmtime,
+    )
+    for path in files[:-PROFILE_KEEP]:
+        os.remove(path)
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or dict(scope["headers"]).get(b"x-profile") not in (b"1", b"true")
+            or not _admin_token(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+        if not _active.acquire(blocking=False):
+            await self.app(scope, receive, _with_header(send, b"x-profile", b"busy"))
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already attached
+            _active.release()
+            await self.app(scope, receive, _with_header(send, b"x-profile", b"busy"))
+            return
+        profile_id = request_id_var.get()
+        if not _PROFILE_ID.match(profile_id):
+            profile_id = os.urandom(8).hex()
+        running = True
+
+        async def send_wrapper(message):
+            nonlocal running
+            # Stop once the response starts; the handler's work is done by then
+            if message["type"] == "http.response.start" and running:
+                profile.disable()
+                running = False
+                _active.release()
+                await run_in_threadpool(_save, profile, profile_id)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if running:
+                profile.disable()
+                _active.release()
+
+
+def _with_header(send, name, value):
+    async def send_wrapper(message):
+        if message["type"] == "http.response.start":
+            message["headers"] = list(message.get("headers", [])) + [(name, value)]
+        await send(message)
+    return send_wrapper
+
+
+@router.get("/admin/profiles/{profile_id}")
+def get_profile(
+    profile_id: str,
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|calls|ncalls)$"),
+    limit: int = Query(50, ge=1, le=500),
+    raw: bool = Query(False),
+    user = Depends(require_admin),
+):
+    path = _profile_path(profile_id)
+    if not _PROFILE_ID.match(profile_id) or not os.path.exists(path):
+        raise HTTPException(404, "Profile not found.")
+    if raw:
+        # Loadable with pstats / snakeviz
+        return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+    return PlainTextResponse(out.getvalue())
@@ -0,0 +1,125 @@
+# report_index.py
+# In-memory search index over one report catalog. Built once per catalog
+# (see reports.CatalogEntry) and never mutated, so searches need no locks.
+import heapq
+import re
+from bisect import bisect_left, bisect_right
+
+_TOKEN = re.compile(r"\w+")
+
+# Per query term: match in the report name, then in the workspace name
+EXACT_NAME, PREFIX_NAME, EXACT_WORKSPACE, PREFIX_WORKSPACE = 3.0, 2.0, 1.5, 1.0
+# Whole query matching the start of, or all of, the report name
+NAME_STARTS_WITH, NAME_EQUALS = 2.0, 5.0
+
+
+def tokenize(text):
+    return _TOKEN.findall((text or "").casefold())
+
+
+def _postings(texts):
+    postings = {}
+    for i, text in enumerate(texts):
+        for token in set(tokenize(text)):
+            postings.setdefault(token, []).append(i)
+    return sorted(postings), postings
+
+
+def _with_prefix(tokens, prefix):
+    i = bisect_left(tokens, prefix)
+    while i < len(tokens) and tokens[i].startswith(prefix):
+        yield tokens[i]
+        i += 1
+
+
+class ReportIndex:
+    def __init__(self, reports):
+        self.reports = reports
+        self._names = [(r.get("report_name") or "").casefold() for r in reports]
+        self._name_tokens, self._name_postings = _postings(r.get("report_name") for r in reports)
+        self._by_workspace, self._by_dataset = {}, {}
+        workspace_names = {}
+        for i, r in enumerate(reports):
+            self._by_workspace.setdefault(r.get("workspace_id"), []).append(i)
+            self._by_dataset.setdefault(r.get("dataset_id"), []).append(i)
+            workspace_names.setdefault(r.get("workspace_id"), r.get("workspace_name"))
+        self._workspace_ids = list(workspace_names)
+        self._workspace_tokens, self._workspace_postings = _postings(workspace_names.values())
+        # Browse order (no query): by name
+        self._order = sorted(range(len(reports)), key=lambda i: self.sort_key(i, 0.0))
+        self._rank = [0] * len(reports)
+        for position, i in enumerate(self._order):
+            self._rank[i] = position
+
+    def sort_key(self, i, score):
+        r = self.reports[i]
+        return (-score, self._names[i], r.get("workspace_id") or "", r.get("report_id") or "")
+
+    def _term_scores(self, term):
+        scores = {}
+        for token in _with_prefix(self._name_tokens, term):
+            weight = EXACT_NAME if token == term else PREFIX_NAME
+            for i in self._name_postings[token]:
+                if scores.get(i, 0) < weight:
+                    scores[i] = weight
+        for token in _with_prefix(self._workspace_tokens, term):
+            weight = EXACT_WORKSPACE if token == term else PREFIX_WORKSPACE
+            for w in self._workspace_postings[token]:
+                for i in self._by_workspace[self._workspace_ids[w]]:
+                    if scores.get(i, 0) < weight:
+                        scores[i] = weight
+        return scores
+
+    def search(self, q="", workspace_id=None, dataset_id=None, limit=50, after=None):
+        # Returns (reports, total matches, sort key to continue after or None);
+        # after is that key from a previous page. Every term must match,
+        # each as a prefix of a word in the report or workspace name.
+        terms = tokenize(q)
+        if not terms:
+            return self._browse(workspace_id, dataset_id, limit, after)
+        scores = None
+        for term in terms:
+            term_scores = self._term_scores(term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {i: s + term_scores[i] for i, s in scores.items() if i in term_scores}
+            if not scores:
+                break
+        phrase = q.strip().casefold()
+        for i in scores:
+            if self._names[i] == phrase:
+                scores[i] += NAME_EQUALS
+            elif self._names[i].startswith(phrase):
+                scores[i] += NAME_STARTS_WITH
+
+        if workspace_id is not None:
+            allowed = set(self._by_workspace.get(workspace_id, ()))
+            scores = {i: s for i, s in scores.items() if i in allowed}
+        if dataset_id is not None:
+            allowed = set(self._by_dataset.get(dataset_id, ()))
+            scores = {i: s for i, s in scores.items() if i in allowed}
+
+        keys = (self.sort_key(i, s) + (i,) for i, s in scores.items())
+        if after is not None:
+            after = tuple(after)
+            keys = (k for k in keys if k[:4] > after)
+        page = heapq.nsmallest(limit + 1, keys)
+        next_key = page[limit - 1][:4] if len(page) > limit else None
+        return [self.reports[k[4]] for k in page[:limit]], len(scores), next_key
+
+    def _browse(self, workspace_id, dataset_id, limit, after):
+        candidates = self._order
+        if workspace_id is not None:
+            candidates = self._by_workspace.get(workspace_id, [])
+        if dataset_id is not None:
+            by_dataset = self._by_dataset.get(dataset_id, [])
+            candidates = by_dataset if workspace_id is None else set(candidates).intersection(by_dataset)
+        if candidates is not self._order:
+            candidates = sorted(candidates, key=self._rank.__getitem__)
+        start = 0
+        if after is not None:
+            start = bisect_right(candidates, tuple(after), key=lambda i: self.sort_key(i, 0.0))
+        page = candidates[start:start + limit + 1]
+        next_key = self.sort_key(page[limit - 1], 0.0) if len(page) > limit else None
+        return [self.reports[i] for i in page[:limit]], len(candidates), next_key
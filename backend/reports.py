@@ -1,34 +1,125 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from models import User  # Add UserCredential if you use it here
 from database import get_db
 from auth import get_current_user
-from powerbi_utils import get_powerbi_credentials, get_access_token
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import requests
+from powerbi_utils import get_powerbi_credentials, get_access_token, credential_key, cache_report_info
+from cache import TTLCache, SingleFlight
+from report_index import ReportIndex
+from email.utils import formatdate, parsedate_to_datetime
+import asyncio
+import base64
+import hashlib
+import httpx
+import json
+import logging
+import os
+import time
+import powerbi_client
+from fetch_scheduler import scheduler as fetch_scheduler
 
 router = APIRouter()
+logger = logging.getLogger("reports")
 
-def get_workspaces(headers):
-    api_base = "https://api.powerbi.com/v1.0/myorg"
-    resp = requests.get(f"{api_base}/groups", headers=headers, verify=False, timeout=20)
-    if not resp.ok:
+# Seconds a built catalog is served as fresh; after that it is served stale
+# while a background task rebuilds it.
+CATALOG_TTL = int(os.getenv("REPORTS_CATALOG_TTL", "300"))
+# Seconds a stale catalog may still be served before a rebuild is awaited.
+CATALOG_MAX_STALE = int(os.getenv("REPORTS_CATALOG_MAX_STALE", "86400"))
+CATALOG_CACHE_SIZE = int(os.getenv("REPORTS_CATALOG_CACHE_SIZE", "256"))
+# Per workspace listing, counted from when it gets a fetch slot
+WORKSPACE_FETCH_TIMEOUT = float(os.getenv("REPORTS_WORKSPACE_TIMEOUT", "20"))
+# "auto" lists every workspace's reports in one admin call
+# (admin/groups?$expand=reports) when the credential has read-only admin API
+# access, and falls back to one call per workspace when it doesn't.
+REPORTS_EXPAND = os.getenv("REPORTS_EXPAND", "off").lower()
+EXPAND_PAGE_SIZE = 5000
+# How long a credential refused by the admin API is not asked again
+EXPAND_DENIED_TTL = int(os.getenv("REPORTS_EXPAND_DENIED_TTL", "3600"))
+NDJSON = "application/x-ndjson"
+
+_catalogs = TTLCache("report_catalogs", maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_MAX_STALE)
+_catalog_flight = SingleFlight()
+_background_refreshes = {}
+_expand_denied = TTLCache("reports_expand_denied", maxsize=1024, ttl=EXPAND_DENIED_TTL)
+
+async def get_workspaces(headers):
+    api_base = powerbi_client.API_BASE
+    resp = await powerbi_client.get(f"{api_base}/groups", headers=headers, operation="list_workspaces")
+    if not resp.is_success:
         raise HTTPException(400, f"Failed to fetch workspaces: {resp.text}")
     return resp.json()["value"]
 
-def fetch_reports_for_workspace(ws, headers, api_base):
+async def fetch_expanded_reports(key, headers):
+    # {workspace_id: [report]} from the admin listing, or None when it can't be used
+    if REPORTS_EXPAND != "auto" or _expand_denied.get(key):
+        return None
+    api_base = powerbi_client.API_BASE
+    expanded, skip = {}, 0
+    while True:
+        try:
+            resp = await asyncio.wait_for(
+                powerbi_client.get(
+                    f"{api_base}/admin/groups",
+                    params={"$expand": "reports", "$top": EXPAND_PAGE_SIZE, "$skip": skip},
+                    headers=headers,
+                    operation="list_workspaces_expanded",
+                ),
+                WORKSPACE_FETCH_TIMEOUT,
+            )
+        except Exception as e:
+            logger.warning("expanded workspace listing failed: %s", str(e) or type(e).__name__)
+            return None
+        if resp.status_code in (401, 403, 404):
+            _expand_denied.set(key, True)
+            return None
+        if not resp.is_success:
+            logger.warning("expanded workspace listing failed", extra={"status": resp.status_code})
+            return None
+        page = resp.json().get("value", [])
+        for ws in page:
+            expanded[ws["id"]] = ws.get("reports") or []
+        if len(page) < EXPAND_PAGE_SIZE:
+            return expanded
+        skip += EXPAND_PAGE_SIZE
+
+async def fetch_workspace_reports(ws, headers, api_base, tenant_id=None):
+    # Returns (reports, error) so callers can tell an empty workspace from a failed one.
     ws_id = ws["id"]
-    ws_name = ws.get("name", "")
     try:
-        resp = requests.get(
-            f"{api_base}/groups/{ws_id}/reports",
-            headers=headers,
-            verify=False,
-            timeout=20
-        )
-        reports = resp.json().get("value", []) if resp.ok else []
-    except Exception:
-        reports = []
+        async with fetch_scheduler.slot(tenant_id) as limiter:
+            start = time.perf_counter()
+            try:
+                resp = await asyncio.wait_for(
+                    powerbi_client.get(
+                        f"{api_base}/groups/{ws_id}/reports",
+                        headers=headers,
+                        operation="list_reports",
+                        on_attempt=limiter.on_response,
+                    ),
+                    WORKSPACE_FETCH_TIMEOUT,
+                )
+            except (asyncio.TimeoutError, httpx.TimeoutException):
+                limiter.on_timeout(time.perf_counter() - start)
+                raise
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        return [], "timeout"
+    except Exception as e:
+        return [], str(e) or type(e).__name__
+    if not resp.is_success:
+        return [], f"HTTP {resp.status_code}"
+    return _report_records(ws, resp.json().get("value", [])), None
+
+def _report_records(ws, values):
+    ws_id = ws["id"]
+    ws_name = ws.get("name", "")
+    # Seeds the metadata cache the embed routes read
+    for rpt in values:
+        if rpt.get("id"):
+            cache_report_info(ws_id, rpt["id"], rpt)
     return [
         {
             "report_name": rpt.get("name"),
@@ -38,31 +129,237 @@ def fetch_reports_for_workspace(ws, headers, api_base):
             "embed_url": rpt.get("embedUrl"),
             "dataset_id": rpt.get("datasetId"),
         }
-        for rpt in reports
+        for rpt in values
     ]
 
+async def iter_workspace_reports(workspaces, headers, tenant_id=None, expanded=None):
+    # Yields (workspace, reports, error) in completion order. Workspaces found
+    # in an expanded listing come first; the rest are fetched through the
+    # process-wide scheduler under the tenant's adaptive limit.
+    api_base = powerbi_client.API_BASE
+    expanded = expanded or {}
+    for ws in workspaces:
+        if ws["id"] in expanded:
+            yield ws, _report_records(ws, expanded[ws["id"]]), None
+
+    async def fetch(ws):
+        reports, error = await fetch_workspace_reports(ws, headers, api_base, tenant_id)
+        return ws, reports, error
+
+    tasks = [asyncio.ensure_future(fetch(ws)) for ws in workspaces if ws["id"] not in expanded]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def build_report_catalog(client_id, tenant_id, secret):
+    # 1. Get Power BI token
+    token = await get_access_token(client_id, tenant_id, secret)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # 2. Get all workspaces, and their reports in one call where permitted
+    workspaces = await get_workspaces(headers)
+    expanded = await fetch_expanded_reports(credential_key(client_id, tenant_id, secret), headers)
+
+    # 3. Fetch the remaining reports concurrently per workspace
+    all_reports, failed_ids = [], set()
+    async for ws, reports, error in iter_workspace_reports(workspaces, headers, tenant_id, expanded):
+        all_reports.extend(reports)
+        if error is not None:
+            failed_ids.add(ws["id"])
+    # Returns the workspace ids whose listing failed or timed out as well
+    return all_reports, failed_ids
+
+class CatalogEntry:
+    def __init__(self, reports, previous=None, partial=False):
+        self.reports = reports
+        self.body = json.dumps(reports).encode()
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.built_at = time.monotonic()
+        if partial:
+            # Some workspaces failed; stale from the start so the next request retries
+            self.built_at -= CATALOG_TTL
+        self._index = None
+        if previous is not None and previous.etag == self.etag:
+            self.last_modified = previous.last_modified
+        else:
+            self.last_modified = formatdate(usegmt=True)
+
+    def is_fresh(self):
+        return time.monotonic() - self.built_at < CATALOG_TTL
+
+    async def get_index(self):
+        # Built on the first search against this catalog, in a worker thread
+        # since it takes a while for large catalogs
+        if self._index is None:
+            self._index = await run_in_threadpool(ReportIndex, self.reports)
+        return self._index
+
+def _store_catalog(key, reports, failed_ids):
+    # A workspace whose listing failed keeps its reports from the previous
+    # catalog rather than dropping out of it until the next rebuild
+    previous = _catalogs.peek(key)
+    if failed_ids and previous is not None:
+        reports = reports + [r for r in previous.reports if r["workspace_id"] in failed_ids]
+    entry = CatalogEntry(reports, previous=previous, partial=bool(failed_ids))
+    _catalogs.set(key, entry)
+    return entry
+
+async def _rebuild_catalog(key, client_id, tenant_id, secret):
+    async def build():
+        reports, failed_ids = await build_report_catalog(client_id, tenant_id, secret)
+        return _store_catalog(key, reports, failed_ids)
+    return await _catalog_flight.do(key, build)
+
+def _refresh_in_background(key, client_id, tenant_id, secret):
+    if key in _background_refreshes:
+        return
+
+    async def run():
+        try:
+            await _rebuild_catalog(key, client_id, tenant_id, secret)
+        except Exception as e:
+            logger.warning("background report catalog refresh failed: %s", e)
+        finally:
+            _background_refreshes.pop(key, None)
+
+    _background_refreshes[key] = asyncio.create_task(run())
+
+def _not_modified(request: Request, entry):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return entry.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(entry.last_modified)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+async def _catalog_entry(db, user, refresh=False):
+    client_id, tenant_id, secret = await run_in_threadpool(get_powerbi_credentials, db, user)
+    key = credential_key(client_id, tenant_id, secret)
+
+    # Serve the cached catalog, rebuilding stale copies in the background
+    entry = None if refresh else _catalogs.get(key)
+    if entry is None:
+        entry = await _rebuild_catalog(key, client_id, tenant_id, secret)
+    elif not entry.is_fresh():
+        _refresh_in_background(key, client_id, tenant_id, secret)
+    return entry
+
 @router.get("/reports")
-def get_all_reports(
+async def get_all_reports(
+    request: Request,
+    refresh: bool = Query(False),
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    if NDJSON in request.headers.get("accept", ""):
+        return await stream_all_reports(refresh, db, user)
+
+    entry = await _catalog_entry(db, user, refresh)
+    headers = {
+        "ETag": entry.etag,
+        "Last-Modified": entry.last_modified,
+        "Cache-Control": "private, no-cache",
+    }
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+def _ndjson(record):
+    return json.dumps(record) + "\n"
+
+async def stream_cached_catalog(entry):
+    by_workspace = {}
+    for rpt in entry.reports:
+        by_workspace.setdefault((rpt["workspace_id"], rpt["workspace_name"]), []).append(rpt)
+    for (ws_id, ws_name), reports in by_workspace.items():
+        yield _ndjson({"type": "workspace", "workspace_id": ws_id, "workspace_name": ws_name, "reports": reports})
+    yield _ndjson({
+        "type": "summary",
+        "cached": True,
+        "workspaces": len(by_workspace),
+        "reports": len(entry.reports),
+        "failed": [],
+        "timed_out": [],
+    })
+
+async def stream_report_catalog(key, workspaces, headers, tenant_id=None):
+    all_reports, failed, timed_out = [], [], []
+    expanded = await fetch_expanded_reports(key, headers)
+    async for ws, reports, error in iter_workspace_reports(workspaces, headers, tenant_id, expanded):
+        ws_id, ws_name = ws["id"], ws.get("name", "")
+        if error is None:
+            all_reports.extend(reports)
+            yield _ndjson({"type": "workspace", "workspace_id": ws_id, "workspace_name": ws_name, "reports": reports})
+        elif error == "timeout":
+            timed_out.append({"workspace_id": ws_id, "workspace_name": ws_name})
+        else:
+            failed.append({"workspace_id": ws_id, "workspace_name": ws_name, "error": error})
+
+    # A completed live stream doubles as a catalog rebuild
+    _store_catalog(key, all_reports, {ws["workspace_id"] for ws in failed + timed_out})
+    yield _ndjson({
+        "type": "summary",
+        "cached": False,
+        "workspaces": len(workspaces),
+        "reports": len(all_reports),
+        "failed": failed,
+        "timed_out": timed_out,
+    })
+
+@router.get("/reports/stream")
+async def stream_all_reports(
+    refresh: bool = Query(False),
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    # 1. Get Power BI credentials and token
-    client_id, tenant_id, secret = get_powerbi_credentials(db, user)
-    token = get_access_token(client_id, tenant_id, secret)
-    api_base = "https://api.powerbi.com/v1.0/myorg"
+    client_id, tenant_id, secret = await run_in_threadpool(get_powerbi_credentials, db, user)
+    key = credential_key(client_id, tenant_id, secret)
+
+    entry = None if refresh else _catalogs.get(key)
+    if entry is not None and entry.is_fresh():
+        return StreamingResponse(stream_cached_catalog(entry), media_type=NDJSON)
+
+    # Resolve token and workspace list up front so their errors keep a proper status
+    token = await get_access_token(client_id, tenant_id, secret)
     headers = {"Authorization": f"Bearer {token}"}
+    workspaces = await get_workspaces(headers)
+    return StreamingResponse(stream_report_catalog(key, workspaces, headers, tenant_id), media_type=NDJSON)
 
-    # 2. Get all workspaces
-    workspaces = get_workspaces(headers)
+def _encode_search_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
 
-    # 3. Fetch all reports concurrently per workspace
-    all_reports = []
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = [
-            executor.submit(fetch_reports_for_workspace, ws, headers, api_base)
-            for ws in workspaces
-        ]
-        for future in as_completed(futures):
-            all_reports.extend(future.result())
+def _decode_search_cursor(cursor):
+    try:
+        score, name, workspace_id, report_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), str(name), str(workspace_id), str(report_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor.")
 
-    return all_reports
+@router.get("/reports/search")
+async def search_reports(
+    q: str = Query("", max_length=200),
+    workspace_id: Optional[str] = None,
+    dataset_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    # Ranked search over the cached catalog: report-name matches before
+    # workspace-name matches, then by name. Pages with next_cursor.
+    after = _decode_search_cursor(cursor) if cursor else None
+    entry = await _catalog_entry(db, user)
+    index = await entry.get_index()
+    results, total, next_key = index.search(q, workspace_id, dataset_id, limit, after)
+    return {
+        "results": results,
+        "total": total,
+        "next_cursor": _encode_search_cursor(next_key) if next_key else None,
+    }
@@ -1,6 +1,7 @@
 # schemas.py
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Optional, Literal
+from datetime import datetime
 
 class RegisterModel(BaseModel):
     username: str
@@ -40,4 +41,20 @@ class LayoutReportModel(BaseModel):
 class DashboardLayoutModel(BaseModel):
     layout_name: str
     description: Optional[str] = None
-    layout_data: List[LayoutReportModel]
\ No newline at end of file
+    layout_data: List[LayoutReportModel]
+
+class LayoutImportModel(DashboardLayoutModel):
+    # One line of a /dashboard-layouts/import body, as written by the export
+    is_favorite: bool = False
+    created_at: Optional[datetime] = None
+    username: Optional[str] = None
+
+class PatchOperation(BaseModel):
+    # One RFC 6902 operation; "value" and "from" are only read when sent.
+    op: Literal["add", "remove", "replace", "move", "copy", "test"]
+    path: str
+    value: Any = None
+    from_: Optional[str] = Field(None, alias="from")
+
+class RefreshTokenModel(BaseModel):
+    refresh_token: str
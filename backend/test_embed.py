@@ -0,0 +1,42 @@
+import asyncio
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import embed
+import main
+
+
+def test_streams_accept_only_a_ticket_for_their_own_path():
+    with TestClient(main.app) as client:
+        client.post("/register", json={"username": "tickets", "password": "p", "first_name": "a", "last_name": "b"})
+        token = client.post("/login", data={"username": "tickets", "password": "p"}).json()["access_token"]
+        ticket = client.post(
+            "/dashboard-layout/1/embed/stream-ticket", headers={"Authorization": f"Bearer {token}"}
+        ).json()["ticket"]
+
+        assert client.get("/dashboard-layout/1/embed/stream").status_code == 401
+        assert client.get("/dashboard-layout/1/embed/stream", params={"access_token": token}).status_code == 401
+        assert client.get("/dashboard-layout/2/embed/stream", params={"ticket": ticket}).status_code == 401
+        # Past authentication; fails on the missing layout instead
+        assert client.get("/dashboard-layout/1/embed/stream", params={"ticket": ticket}).status_code == 404
+
+
+def test_credentials_are_loaded_off_the_event_loop(monkeypatch):
+    calls = []
+
+    def get_powerbi_credentials(db, user):
+        try:
+            asyncio.get_running_loop()
+            calls.append("loop")
+        except RuntimeError:
+            calls.append("thread")
+        raise HTTPException(400, "No Power BI credentials set for user.")
+
+    monkeypatch.setattr(embed, "get_powerbi_credentials", get_powerbi_credentials)
+    with TestClient(main.app) as client:
+        client.post("/register", json={"username": "embeds", "password": "p", "first_name": "a", "last_name": "b"})
+        token = client.post("/login", data={"username": "embeds", "password": "p"}).json()["access_token"]
+        auth = {"Authorization": f"Bearer {token}"}
+        body = {"group_id": "g", "report_id": "r", "dataset_id": "d"}
+        assert client.post("/embed-report", headers=auth, json=body).status_code == 400
+        assert client.post("/create-embed", headers=auth, json=body).status_code == 400
+    assert calls == ["thread", "thread"]
@@ -0,0 +1,35 @@
+import asyncio
+from embed_renewal import EmbedSession, RenewalScheduler
+
+TOKEN = {"token": "t", "expiration": "2099-01-01T00:00:00Z"}
+
+
+def _session(targets, cred_key="k"):
+    return EmbedSession(1, 7, ("c", "t", "s"), cred_key, targets, ["d"], TOKEN)
+
+
+def test_streams_with_changed_targets_release_the_session():
+    scheduler = RenewalScheduler()
+    first, second = asyncio.Queue(), asyncio.Queue()
+    first_session = scheduler.subscribe(_session([("g", "r1")]), first)
+    second_session = scheduler.subscribe(_session([("g", "r1"), ("g", "r2")], cred_key="k2"), second)
+
+    tracked = scheduler.sessions[(1, 7)]
+    assert tracked.cred_key == "k2"
+    assert tracked.targets == [("g", "r1"), ("g", "r2")]
+
+    scheduler.unsubscribe(first_session, first)
+    assert scheduler.stats()["sessions"] == 1
+    scheduler.unsubscribe(second_session, second)
+    assert scheduler.stats() == {"sessions": 0, "subscribers": 0, "renewals": 0, "failures": 0}
+
+
+def test_last_stream_to_close_releases_the_session():
+    scheduler = RenewalScheduler()
+    first, second = asyncio.Queue(), asyncio.Queue()
+    first_session = scheduler.subscribe(_session([("g", "r1")]), first)
+    second_session = scheduler.subscribe(_session([("g", "r2")]), second)
+
+    scheduler.unsubscribe(second_session, second)
+    scheduler.unsubscribe(first_session, first)
+    assert scheduler.stats()["sessions"] == 0
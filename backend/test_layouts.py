@@ -0,0 +1,56 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="module")
+def auth(client):
+    client.post("/register", json={"username": "layouts", "password": "p", "first_name": "a", "last_name": "b"})
+    token = client.post("/login", data={"username": "layouts", "password": "p"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(scope="module")
+def layout_id(client, auth):
+    resp = client.post("/dashboard-layout", headers=auth, json={
+        "layout_name": "tests",
+        "layout_data": [{"report_id": "r1", "group_id": "g1"}],
+    })
+    return resp.json()["id"]
+
+
+def test_comments_for_a_report_not_on_the_layout_are_rejected(client, auth, layout_id):
+    resp = client.put(f"/dashboard-layout/{layout_id}/report-comments", headers=auth, json={
+        "report_id": "missing", "comments": [{"text": "x", "author": "a"}],
+    })
+    assert resp.status_code == 404
+    resp = client.post(
+        f"/dashboard-layout/{layout_id}/reports/missing/comments", headers=auth, json={"text": "x", "author": "a"}
+    )
+    assert resp.status_code == 404
+
+    resp = client.post(
+        f"/dashboard-layout/{layout_id}/reports/r1/comments", headers=auth, json={"text": "x", "author": "a"}
+    )
+    assert resp.status_code == 200
+    resp = client.get(f"/dashboard-layout/{layout_id}/reports/missing/comments", headers=auth)
+    assert resp.json()["comments"] == []
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "add", "path": "/layout_data/²", "value": {"report_id": "r2", "group_id": "g1"}}],
+    [{"op": "replace", "path": "/layout_data/01", "value": {"report_id": "r2", "group_id": "g1"}}],
+    [
+        {"op": "replace", "path": "/layout_data", "value": {"x": 1}},
+        {"op": "add", "path": "/layout_data/x", "value": 2},
+    ],
+])
+def test_malformed_patch_paths_are_rejected(client, auth, layout_id, operations):
+    resp = client.patch(f"/dashboard-layout/{layout_id}", headers=auth, json=operations)
+    assert resp.status_code == 422
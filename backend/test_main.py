@@ -0,0 +1,33 @@
+import os
+from fastapi.testclient import TestClient
+import auth
+import main
+from bench.startup_budget import IMPORT_BUDGET_MS, STARTUP_BUDGET_MS, probe
+
+
+def test_stats_endpoints_require_admin():
+    with TestClient(main.app) as client:
+        client.post("/register", json={"username": "stats", "password": "p", "first_name": "a", "last_name": "b"})
+        token = client.post("/login", data={"username": "stats", "password": "p"}).json()["access_token"]
+        auth = {"Authorization": f"Bearer {token}"}
+        assert client.get("/cache/stats", headers=auth).status_code == 403
+        assert client.get("/db/stats", headers=auth).status_code == 403
+
+
+def test_metrics_require_admin_without_a_metrics_token(monkeypatch):
+    with TestClient(main.app) as client:
+        assert client.get("/metrics").status_code == 401
+        client.post("/register", json={"username": "metrics", "password": "p", "first_name": "a", "last_name": "b"})
+        token = client.post("/login", data={"username": "metrics", "password": "p"}).json()["access_token"]
+        assert client.get("/metrics", headers={"Authorization": f"Bearer {token}"}).status_code == 403
+        monkeypatch.setattr(auth, "ADMIN_USERNAMES", {"metrics"})
+        assert client.get("/metrics", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+
+def test_startup_stays_within_budget():
+    # Fresh interpreter on the test database, without the test-only auto-migration
+    result = probe(dict(os.environ, DB_AUTO_MIGRATE="false"))
+    assert result["healthz"] == 200
+    assert result["readyz"] == 200
+    assert result["import_ms"] <= IMPORT_BUDGET_MS
+    assert result["startup_ms"] <= STARTUP_BUDGET_MS
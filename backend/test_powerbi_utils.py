@@ -0,0 +1,10 @@
+import powerbi_utils
+from powerbi_utils import REPORT_NOT_FOUND, cache_report_not_found, get_cached_report_info
+
+
+def test_a_cached_not_found_counts_one_report_info_miss():
+    cache_report_not_found("cred", "g", "gone")
+    misses = powerbi_utils._report_info_cache.misses
+    assert get_cached_report_info("g", "gone", "cred") is REPORT_NOT_FOUND
+    assert powerbi_utils._report_info_cache.misses == misses + 1
+    assert get_cached_report_info("g", "gone") is None
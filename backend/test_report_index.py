@@ -0,0 +1,85 @@
+import json
+from report_index import ReportIndex
+
+
+def _report(report_id, name, workspace_id="w1", workspace_name="Finance", dataset_id="d1"):
+    return {
+        "report_id": report_id,
+        "report_name": name,
+        "workspace_id": workspace_id,
+        "workspace_name": workspace_name,
+        "dataset_id": dataset_id,
+    }
+
+
+def _ids(reports):
+    return [r["report_id"] for r in reports]
+
+
+def _round_trip(key):
+    # As the API's cursor does: JSON out, tuple back in
+    return tuple(json.loads(json.dumps(key)))
+
+
+def _all_pages(index, limit, **filters):
+    pages, after = [], None
+    while True:
+        results, _, next_key = index.search(limit=limit, after=after, **filters)
+        pages.append(_ids(results))
+        if next_key is None:
+            return pages
+        after = _round_trip(next_key)
+
+
+def test_exact_name_matches_rank_before_prefix_and_workspace_matches():
+    index = ReportIndex([
+        _report("prefix", "Regional salesforce", workspace_id="ops", workspace_name="Ops"),
+        _report("workspace", "Pipeline", workspace_id="sales", workspace_name="Sales"),
+        _report("exact", "Regional sales", workspace_id="ops", workspace_name="Ops"),
+        _report("starts", "Salesforce pipeline", workspace_id="ops", workspace_name="Ops"),
+        _report("equals", "Sales", workspace_id="ops", workspace_name="Ops"),
+        _report("none", "Inventory", workspace_id="ops", workspace_name="Ops"),
+    ])
+    results, total, next_key = index.search("sales")
+    # Whole name, then name starting with the query, exact word, word prefix, workspace
+    assert _ids(results) == ["equals", "starts", "exact", "prefix", "workspace"]
+    assert total == 5
+    assert next_key is None
+
+
+def test_every_term_must_match():
+    index = ReportIndex([
+        _report("both", "Sales margin"),
+        _report("one", "Sales volume"),
+    ])
+    assert _ids(index.search("sal marg")[0]) == ["both"]
+    assert index.search("sales nothing")[1] == 0
+
+
+def test_filters_combine():
+    index = ReportIndex([
+        _report("a", "Sales", workspace_id="w1", dataset_id="d1"),
+        _report("b", "Sales", workspace_id="w1", dataset_id="d2"),
+        _report("c", "Sales", workspace_id="w2", dataset_id="d1"),
+        _report("d", "Costs", workspace_id="w1", dataset_id="d1"),
+    ])
+    assert _ids(index.search("sales", workspace_id="w1", dataset_id="d1")[0]) == ["a"]
+    assert _ids(index.search(workspace_id="w1", dataset_id="d1")[0]) == ["d", "a"]
+    assert _ids(index.search(dataset_id="d1")[0]) == ["d", "a", "c"]
+    assert index.search("sales", workspace_id="missing")[1] == 0
+
+
+def test_pages_cover_every_match_once_in_order():
+    reports = [
+        _report(f"r{i:02d}", f"Sales {i % 7}", workspace_id=f"w{i % 3}", workspace_name="Finance")
+        for i in range(23)
+    ] + [_report(f"o{i}", f"Other {i}", workspace_id="ws", workspace_name="Sales") for i in range(5)]
+    index = ReportIndex(reports)
+
+    for filters in ({"q": "sales"}, {"q": ""}, {"q": "", "workspace_id": "w0"}):
+        full, total, _ = index.search(limit=100, **filters)
+        pages = _all_pages(index, limit=3, **filters)
+        assert len(pages) > 2
+        assert all(len(page) == 3 for page in pages[:-1])
+        assert [report_id for page in pages for report_id in page] == _ids(full)
+        assert len(full) == total
@@ -0,0 +1,42 @@
+import asyncio
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import main
+import reports
+
+
+def _report(workspace_id, report_id):
+    return {"workspace_id": workspace_id, "workspace_name": workspace_id, "report_id": report_id}
+
+
+def test_failed_workspaces_keep_their_previous_reports():
+    key = "test-catalog"
+    reports._catalogs.pop(key)
+    entry = reports._store_catalog(key, [_report("w1", "a"), _report("w2", "b")], set())
+    assert entry.is_fresh()
+
+    entry = reports._store_catalog(key, [_report("w1", "c")], {"w2"})
+    assert [r["report_id"] for r in entry.reports] == ["c", "b"]
+    assert not entry.is_fresh()
+    assert reports._catalogs.peek(key) is entry
+
+
+def test_credentials_are_loaded_off_the_event_loop(monkeypatch):
+    calls = []
+
+    def get_powerbi_credentials(db, user):
+        try:
+            asyncio.get_running_loop()
+            calls.append("loop")
+        except RuntimeError:
+            calls.append("thread")
+        raise HTTPException(400, "No Power BI credentials set for user.")
+
+    monkeypatch.setattr(reports, "get_powerbi_credentials", get_powerbi_credentials)
+    with TestClient(main.app) as client:
+        client.post("/register", json={"username": "catalog", "password": "p", "first_name": "a", "last_name": "b"})
+        token = client.post("/login", data={"username": "catalog", "password": "p"}).json()["access_token"]
+        auth = {"Authorization": f"Bearer {token}"}
+        assert client.get("/reports", headers=auth).status_code == 400
+        assert client.get("/reports/stream", headers=auth).status_code == 400
+    assert calls == ["thread", "thread"]
@@ -0,0 +1,13 @@
+import pytest
+from tokens import TokenError, decode_token, encode_token
+
+
+@pytest.mark.parametrize("claims", [
+    ["not", "a", "dict"],
+    "access",
+    {"typ": "access", "exp": "tomorrow"},
+    {"typ": "access", "exp": None},
+])
+def test_signed_tokens_with_malformed_claims_are_rejected(claims):
+    with pytest.raises(TokenError, match="Malformed token."):
+        decode_token(encode_token(claims), "access")
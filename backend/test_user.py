@@ -0,0 +1,22 @@
+from fastapi.testclient import TestClient
+import main
+from database import SessionLocal
+from models import User, UserCredential
+
+
+def test_credentials_update_when_the_stored_secret_cannot_be_decrypted():
+    with TestClient(main.app) as client:
+        client.post("/register", json={"username": "creds", "password": "p", "first_name": "a", "last_name": "b"})
+        token = client.post("/login", data={"username": "creds", "password": "p"}).json()["access_token"]
+        auth = {"Authorization": f"Bearer {token}"}
+        assert client.post("/credentials", headers=auth, json={"client_id": "c", "tenant_id": "t", "secret": "s"}).status_code == 200
+
+        # As if FERNET_KEY had been rotated since the secret was stored
+        with SessionLocal() as db:
+            user = db.query(User).filter_by(username="creds").one()
+            db.query(UserCredential).filter_by(user_id=user.id).update({"secret_enc": "not-a-fernet-token"})
+            db.commit()
+
+        resp = client.post("/credentials", headers=auth, json={"client_id": "c2", "tenant_id": "t", "secret": "s2"})
+        assert resp.status_code == 200
+        assert client.get("/credentials", headers=auth).json()["client_id"] == "c2"
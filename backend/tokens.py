@@ -0,0 +1,122 @@
+# tokens.py
+import base64
+import binascii
+import functools
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+
+# Access tokens cover a working shift; refresh tokens let clients renew them.
+ACCESS_TOKEN_TTL = int(os.getenv("AUTH_ACCESS_TOKEN_TTL", "28800"))
+REFRESH_TOKEN_TTL = int(os.getenv("AUTH_REFRESH_TOKEN_TTL", "604800"))
+# Stream tickets stand in for the access token in SSE URLs, which end up in logs
+STREAM_TICKET_TTL = int(os.getenv("AUTH_STREAM_TICKET_TTL", "60"))
+
+
+class TokenError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def signing_keys():
+    # AUTH_SIGNING_KEYS="kid:secret,kid:secret" - the first key signs new
+    # tokens, every listed key is accepted, so keys can be rotated by
+    # prepending a new one and dropping the old one once its tokens expire.
+    raw = os.getenv("AUTH_SIGNING_KEYS")
+    if raw:
+        keys = []
+        for item in raw.split(","):
+            kid, _, secret = item.strip().partition(":")
+            if not kid or not secret:
+                raise RuntimeError("AUTH_SIGNING_KEYS entries must look like kid:secret.")
+            keys.append((kid, secret.encode()))
+        return keys
+    fernet_key = os.getenv("FERNET_KEY")
+    if not fernet_key:
+        raise RuntimeError("AUTH_SIGNING_KEYS or FERNET_KEY environment variable must be set.")
+    derived = hmac.new(fernet_key.encode(), b"easylink-auth-signing", hashlib.sha256).digest()
+    return [("default", derived)]
+
+@functools.lru_cache(maxsize=None)
+def _keys_by_id():
+    return dict(signing_keys())
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+def _sign(key, signing_input):
+    return hmac.new(key, signing_input, hashlib.sha256).digest()
+
+def encode_token(claims):
+    kid, key = signing_keys()[0]
+    header = {"alg": "HS256", "typ": "JWT", "kid": kid}
+    signing_input = (
+        _b64encode(json.dumps(header, separators=(",", ":")).encode())
+        + b"."
+        + _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    )
+    return (signing_input + b"." + _b64encode(_sign(key, signing_input))).decode()
+
+def decode_token(token, token_type):
+    try:
+        header_b64, payload_b64, signature_b64 = token.encode().split(b".")
+        header = json.loads(_b64decode(header_b64))
+        key = _keys_by_id().get(header.get("kid"))
+        if key is None or header.get("alg") != "HS256":
+            raise TokenError("Unknown signing key.")
+        expected = _sign(key, header_b64 + b"." + payload_b64)
+        if not hmac.compare_digest(expected, _b64decode(signature_b64)):
+            raise TokenError("Invalid token signature.")
+        claims = json.loads(_b64decode(payload_b64))
+        if not isinstance(claims, dict) or not isinstance(claims.get("exp", 0), (int, float)):
+            raise ValueError
+    except (ValueError, binascii.Error, AttributeError):
+        raise TokenError("Malformed token.")
+    if claims.get("typ") != token_type:
+        raise TokenError("Wrong token type.")
+    if claims.get("exp", 0) < time.time():
+        raise TokenError("Token expired.")
+    return claims
+
+def create_access_token(user):
+    now = int(time.time())
+    return encode_token({
+        "sub": str(user.id),
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "typ": "access",
+        "iat": now,
+        "exp": now + ACCESS_TOKEN_TTL,
+    })
+
+def create_refresh_token(user):
+    now = int(time.time())
+    return encode_token({
+        "sub": str(user.id),
+        "typ": "refresh",
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": now + REFRESH_TOKEN_TTL,
+    })
+
+def create_stream_ticket(user, path):
+    # Only accepted by the stream at this path (see auth.get_stream_user)
+    now = int(time.time())
+    return encode_token({
+        "sub": str(user.id),
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "typ": "stream",
+        "path": path,
+        "iat": now,
+        "exp": now + STREAM_TICKET_TTL,
+    })
@@ -1,14 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from cryptography.fernet import InvalidToken
 from models import UserCredential, User
 from schemas import CredentialModel
 from database import get_db
 from auth import get_current_user
-from cryptography.fernet import Fernet
-import os
+from powerbi_utils import get_fernet, invalidate_all_credentials, invalidate_credentials, invalidate_user_credentials
 
 router = APIRouter()
-fernet = Fernet(os.getenv("FERNET_KEY"))
 
 @router.post("/credentials")
 def set_credentials(
@@ -16,9 +15,18 @@ def set_credentials(
     db: Session = Depends(get_db), 
     user: User = Depends(get_current_user)
 ):
+    fernet = get_fernet()
     enc_secret = fernet.encrypt(data.secret.encode()).decode()
     cred = db.query(UserCredential).filter_by(user_id=user.id).first()
     if cred:
+        # Drop cached AAD/embed tokens minted with the old credentials.
+        try:
+            old_secret = fernet.decrypt(cred.secret_enc.encode()).decode()
+        except InvalidToken:
+            # Encrypted under a previous FERNET_KEY; the update still goes through
+            invalidate_all_credentials()
+        else:
+            invalidate_credentials(cred.client_id, cred.tenant_id, old_secret)
         cred.client_id = data.client_id
         cred.tenant_id = data.tenant_id
         cred.secret_enc = enc_secret
@@ -31,6 +39,7 @@ def set_credentials(
         )
         db.add(cred)
     db.commit()
+    invalidate_user_credentials(user.id)
     return {"msg": "Credentials updated"}
 
 @router.get("/credentials")
@@ -41,7 +50,7 @@ def get_credentials(
     cred = db.query(UserCredential).filter_by(user_id=user.id).first()
     if not cred:
         raise HTTPException(404, "No credentials found")
-    secret = fernet.decrypt(cred.secret_enc.encode()).decode()
+    secret = get_fernet().decrypt(cred.secret_enc.encode()).decode()
     return {
         "client_id": cred.client_id,
         "tenant_id": cred.tenant_id,